@@ -1,45 +1,80 @@
 import os
+import functools
 from openai import OpenAI
+from rapidfuzz import process, fuzz
 from .types import ParticipantPreference, MovieRecommendation
-import json
+from .response_cache import RecommendationCache, catalog_version
+from .stream_parse import stream_recommendations
+from .http_pool import sync_http_client
+from data.movie_repository import load_movies
+
+
+def _movies_path() -> str:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir,"..","data","movies.json")
+
+
+@functools.lru_cache(maxsize=1)
+def _load_movies_cached() -> tuple[list[dict], dict[str, dict], list[str]]:
+    """Load movie dataset once per process and build normalized title lookups"""
+    movies = load_movies(_movies_path())
+
+    # Parallel to movies: title.lower().strip() computed once, not per lookup
+    norm_titles = [m['title'].lower().strip() for m in movies]
+    title_index = {}
+    for norm, movie in zip(norm_titles, movies):
+        title_index.setdefault(norm, movie)  # first occurrence wins, like the old scan
+    return movies, title_index, norm_titles
+
+
 class DeepseekClient:
 
     def __init__(self):
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
-        self.client= OpenAI(api_key=self.api_key, base_url="https://api.deepseek.com")
-        self.movies = self._load_movies()
-
-    def _load_movies(self) -> list[dict]:
-        """ load movie dataset from a local JSON file"""
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        movies_path = os.path.join(current_dir,"..","data","movies.json")
-        with open(movies_path,"r",encoding="utf-8") as f:
-            return json.load(f)
+        self.client= OpenAI(
+            api_key=self.api_key,
+            base_url="https://api.deepseek.com",
+            http_client=sync_http_client()
+        )
+        self.movies, self._title_index, self._norm_titles = _load_movies_cached()
+        # Movie catalog is static, so the prompt's movie list is built only once
+        movies_with_trailers = [m for m in self.movies if m.get('trailer_key')][:50]
+        self._movie_list_str = "\n".join(
+            f"- ID:{m['id']} | {m['title']} | {', '.join(m['genres'])} | Rating:{m['vote_average']}"
+            for m in movies_with_trailers
+        )
+        self._movie_list_ids = [m['id'] for m in movies_with_trailers]
+        # Exact-match response cache (same moods/notes -> same prompt)
+        self.rec_cache = RecommendationCache(version=catalog_version(_movies_path()))
         
     def recommend_movies(self,participants: list[ParticipantPreference],num_recommendations: int =5) -> list[MovieRecommendation]:
+        cached = self.rec_cache.get(participants, self._movie_list_ids, n=num_recommendations)
+        if cached is not None:
+            return cached
         #prepare the prompt for deepseek model
         prompt= self._build_prompt(participants,num_recommendations)
-        response= self.client.chat.completions.create(
+        stream= self.client.chat.completions.create(
             model="deepseek-chat",
             messages=[{"role":"user","content":prompt}],
             max_tokens=1000,
-            temperature=0.7)
-        content= response.choices[0].message.content
-        if content is None:
-            return []
-        recommendations= self._parse_response(content)
+            temperature=0.7,
+            stream=True)
+
+        # Parse each {"title", "why"} as soon as it arrives; stop once we have enough
+        recommendations= stream_recommendations(
+            stream,
+            lambda item: self._find_movie_by_title(item.get('title', '')),
+            num_recommendations
+        )
+        self.rec_cache.put(participants, self._movie_list_ids, recommendations, n=num_recommendations)
         return recommendations
         
         
 
     def _build_prompt(self, participants: list[ParticipantPreference], num_recommendations: int) -> str:
-        # Only include movies that have trailers
-        movies_with_trailers = [m for m in self.movies if m.get('trailer_key')]
-        movie_list = "\n".join([
-        f"- ID:{m['id']} | {m['title']} | {', '.join(m['genres'])} | Rating:{m['vote_average']}"
-        for m in movies_with_trailers[:50]
-    ])
-    
+        # Only movies that have trailers (precomputed in __init__)
+        movie_list = self._movie_list_str
+
         prompt = f"""You are a movie recommendation expert.
         A group wants to watch a movie together.
 
@@ -62,54 +97,16 @@ class DeepseekClient:
     def _find_movie_by_title(self, title: str) -> dict | None:
         """Find a movie in the database by title (fuzzy match)"""
         title_lower = title.lower().strip()
-        for movie in self.movies:
-            if movie['title'].lower().strip() == title_lower:
-                return movie
-        # Fuzzy match - partial match
-        for movie in self.movies:
-            if title_lower in movie['title'].lower() or movie['title'].lower() in title_lower:
-                return movie
+        movie = self._title_index.get(title_lower)
+        if movie is not None:
+            return movie
+        # Fuzzy match - best scoring title instead of first substring hit
+        match = process.extractOne(
+            title_lower,
+            self._norm_titles,
+            scorer=fuzz.WRatio,
+            score_cutoff=80
+        )
+        if match:
+            return self.movies[match[2]]
         return None
-
-    def _parse_response(self, response_content: str) -> list[MovieRecommendation]:
-        try:
-            start = response_content.find('[')
-            end = response_content.rfind(']') + 1
-            if start == -1 or end == 0:
-                return []
-            json_str = response_content[start:end]
-            data = json.loads(json_str)
-
-            recommendations = []
-            for item in data:
-                title = item.get('title', '')
-                why = item.get('why', '')
-
-                # Find full movie data from movies.json
-                movie_data = self._find_movie_by_title(title)
-
-                if movie_data:
-                    recommendation = MovieRecommendation(
-                        id=movie_data['id'],
-                        title=movie_data['title'],
-                        why=why,
-                        poster_url=movie_data.get('poster_url'),
-                        overview=movie_data.get('overview'),
-                        vote_average=movie_data.get('vote_average'),
-                        release_year=movie_data.get('release_year'),
-                        genres=movie_data.get('genres', []),
-                        trailer_key=movie_data.get('trailer_key')
-                    )
-                else:
-                    # Fallback if movie not found
-                    recommendation = MovieRecommendation(
-                        id=0,
-                        title=title,
-                        why=why,
-                        genres=[]
-                    )
-                recommendations.append(recommendation)
-            return recommendations
-        except json.JSONDecodeError:
-            return []
-    
\ No newline at end of file
@@ -1,12 +1,46 @@
+import logging
+import threading
 import time
+from concurrent.futures import Future
+from functools import cached_property
 from typing import Optional
 from .types import GatewayResponse, ParticipantPreference, MovieRecommendation, ModelProvider, FairnessStats
 from .groq_client import GroqClient
+from .response_cache import RecommendationCache, catalog_version
 from ml.embeddings import EmbeddingEngine
 from ml.group_fairness import FairGroupRecommender
 from ml.feedback_learner import FeedbackLearner
 from data.movie_repository import MovieRepository
 
+logger = logging.getLogger(__name__)
+
+
+def _movie_to_recommendation(movie: dict, why: str) -> MovieRecommendation:
+    """Catalog dict -> MovieRecommendation (trusted internal data, validation skipped)"""
+    get = movie.get
+    return MovieRecommendation.model_construct(
+        id=movie["id"],
+        title=movie["title"],
+        why=why,
+        poster_url=get("poster_url"),
+        overview=get("overview"),
+        vote_average=get("vote_average"),
+        release_year=get("release_year"),
+        genres=get("genres", []),
+        trailer_key=get("trailer_key")
+    )
+
+
+_MATCH_FIELDS = ("title", "poster_url", "overview", "vote_average", "trailer_key")
+
+
+def _match_details(movie: dict) -> dict:
+    """Movie fields shown on a match card"""
+    get = movie.get
+    details = {field: get(field) for field in _MATCH_FIELDS}
+    details["genres"] = get("genres", [])
+    return details
+
 
 class ModelGateway:
     '''
@@ -21,13 +55,157 @@ class ModelGateway:
     '''
 
     def __init__(self):
-        self.embedding_engine = EmbeddingEngine()
-        self.movie_repo = MovieRepository("data/movies.json")
-        self.groq = GroqClient()
+        # Aynı anda gelen birebir aynı LLM istekleri tek Groq çağrısını paylaşır
+        self._inflight: dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    # Bileşenler ilk kullanımda oluşturulur (cold start'ta sadece gereken yüklenir)
+    @cached_property
+    def embedding_engine(self) -> EmbeddingEngine:
+        return EmbeddingEngine()
+
+    @cached_property
+    def movie_repo(self) -> MovieRepository:
+        return MovieRepository("data/movies.json")
+
+    @cached_property
+    def groq(self) -> GroqClient:
+        return GroqClient()
+
+    @cached_property
+    def fair_recommender(self) -> FairGroupRecommender:
         # Fairness-aware recommender
-        self.fair_recommender = FairGroupRecommender(self.embedding_engine)
+        return FairGroupRecommender(self.embedding_engine)
+
+    @cached_property
+    def feedback_learner(self) -> FeedbackLearner:
         # Feedback learner for online learning
-        self.feedback_learner = FeedbackLearner(self.embedding_engine)
+        return FeedbackLearner(self.embedding_engine)
+
+    @cached_property
+    def rec_cache(self) -> RecommendationCache:
+        # LLM response cache, exact only: "why" metinleri note'a göre yazılıyor,
+        # benzer ama farklı bir note'a dönmemeli
+        return RecommendationCache(version=catalog_version("data/movies.json"))
+
+    @cached_property
+    def response_cache(self) -> RecommendationCache:
+        # Session'sız /recommendations için tüm GatewayResponse cache'i (10 dk TTL);
+        # exact only: isim, mood'lar ve note'lar birebir aynı olmalı
+        return RecommendationCache(
+            maxsize=128,
+            version=catalog_version("data/movies.json"),
+            ttl=600
+        )
+
+    def warm_up(self) -> float:
+        """
+        Startup'ta cold-start maliyetlerini öde: model yükleme, tokenizer + ilk inference
+        (torch.compile açıksa JIT), vector store exact index'i, movies.json.
+        İlk kullanıcı isteği bunları beklemez. Süreyi saniye olarak döner.
+        """
+        start = time.time()
+        engine = self.embedding_engine
+        # embed_query: batcher worker thread'i de başlar
+        embedding = engine.embed_query("warmup")
+        engine.vector_store.query_similar_ids(embedding, n_results=1)
+        # cached_property'leri oluştur
+        _ = self.movie_repo, self.fair_recommender, self.feedback_learner
+        return time.time() - start
+
+    @staticmethod
+    def _to_dicts(participants: list[ParticipantPreference]) -> list[dict]:
+        """Pydantic → {"name", "moods", "note"} dicts for the fairness module (note None → "")"""
+        participants_dict = [
+            p.model_dump(include={"name", "moods", "note"}) for p in participants
+        ]
+        for p in participants_dict:
+            if p["note"] is None:
+                p["note"] = ""
+        return participants_dict
+
+    def _rank_with_llm(
+        self,
+        participants: list[ParticipantPreference],
+        full_movies: list[dict],
+        num_recommendations: int,
+        swipe_history: dict | None = None,
+        round_num: int = 1
+    ) -> list[MovieRecommendation]:
+        """
+        Groq final ranking, served from cache when the same request was seen before.
+        Concurrent identical requests (e.g. group members hitting refresh together)
+        wait on the first one's call instead of each going to Groq.
+        """
+        candidate_ids = [m["id"] for m in full_movies]
+        cache_extra = {
+            "n": num_recommendations,
+            "round": round_num,
+            "swipe_history": swipe_history
+        }
+        cached = self.rec_cache.get(participants, candidate_ids, **cache_extra)
+        if cached is not None:
+            return cached
+
+        key = self.rec_cache.key(participants, candidate_ids, **cache_extra)
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._inflight[key] = future
+        if not is_owner:
+            return list(future.result())
+
+        try:
+            recommendations = self.groq.recommend_from_candidates_movies(
+                participants,
+                full_movies,
+                num_recommendations,
+                swipe_history=swipe_history,
+                round_num=round_num
+            )
+            self.rec_cache.put(participants, candidate_ids, recommendations, **cache_extra)
+            future.set_result(recommendations)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+        return recommendations
+
+    def _movies_with_scores(self, fair_candidates: list[dict]) -> list[dict]:
+        """Fair candidate'ların katalog kayıtları, fairness skorları eklenmiş olarak"""
+        movie_ids = [c["movie_id"] for c in fair_candidates]
+        # Copies: catalog dicts are shared process-wide, scores below are per request
+        full_movies = [dict(m) for m in self.movie_repo.get_movies_by_ids(movie_ids)]
+
+        cand_by_id = {c["movie_id"]: c for c in fair_candidates}
+        for movie in full_movies:
+            c = cand_by_id.get(movie["id"])
+            if c:
+                movie["similarity"] = c["fair_score"]
+                movie["fair_score"] = c["fair_score"]
+                movie["avg_score"] = c["avg_score"]
+                movie["min_score"] = c["min_score"]
+                movie["individual_scores"] = c["individual_scores"]
+        return full_movies
+
+    @staticmethod
+    def _fallback_recs(full_movies: list[dict], k: int) -> list[MovieRecommendation]:
+        """Fairness-only results (LLM skipped or failed), why = per-user scores"""
+        recommendations = []
+        for movie in full_movies[:k]:
+            individual = movie.get("individual_scores")
+            if individual:
+                why = "Fair match - " + ", ".join(
+                    f"{name}: {int(score * 100)}%" for name, score in individual.items()
+                )
+            else:
+                why = "Recommended based on group preferences"
+            recommendations.append(_movie_to_recommendation(movie, why))
+        return recommendations
 
     def recommend(
         self,
@@ -36,15 +214,18 @@ class ModelGateway:
     ) -> GatewayResponse:
         start_time = time.time()
 
+        # Aynı grup (isimler + mood'lar + note'lar) kısa süre önce sorulduysa
+        # embedding, ChromaDB ve LLM adımlarının hepsi atlanır.
+        # (isim -> mood / note eşleşmesi RecommendationCache key'inin parçası)
+        response_key = {"n": num_recommendations}
+        cached = self.response_cache.get(participants, [], **response_key)
+        if cached is not None:
+            return cached[0].model_copy(
+                update={"response_time_ms": int((time.time() - start_time) * 1000)}
+            )
+
         # Convert Pydantic models to dicts for fairness module
-        participants_dict = [
-            {
-                "name": p.name,
-                "moods": p.moods,
-                "note": p.note or ""
-            }
-            for p in participants
-        ]
+        participants_dict = self._to_dicts(participants)
 
         # Get fair candidates (her kullanıcı için ayrı query + fairness birleştirme)
         fair_candidates = self.fair_recommender.recommend_fair(
@@ -54,58 +235,37 @@ class ModelGateway:
             fairness_weight=0.4  # 0=pure avg, 1=pure least misery
         )
 
-        # Get full movie details for fair candidates
-        movie_ids = [c["movie_id"] for c in fair_candidates]
-        full_movies = self.movie_repo.get_movies_by_ids(movie_ids)
+        # Get full movie details for fair candidates (with fairness scores)
+        full_movies = self._movies_with_scores(fair_candidates)
 
-        # Add fairness scores to full movie details
-        for movie in full_movies:
-            for c in fair_candidates:
-                if c["movie_id"] == movie["id"]:
-                    movie["similarity"] = c["fair_score"]
-                    movie["fair_score"] = c["fair_score"]
-                    movie["avg_score"] = c["avg_score"]
-                    movie["min_score"] = c["min_score"]
-                    movie["individual_scores"] = c["individual_scores"]
-                    break
+        # Fast path: solo user (fairness irrelevant) or nothing left for the LLM to narrow down
+        skip_llm = len(participants) == 1 or num_recommendations >= len(full_movies)
 
         # Send to LLM for final ranking
-        try:
-            recommendations = self.groq.recommend_from_candidates_movies(
-                participants,
-                full_movies,
-                num_recommendations
-            )
-            model_used = ModelProvider.GROQ
-
-        except Exception as e:
-            print(f"Groq failed with error: {e}, falling back to fairness-only results")
+        recommendations = None
+        if not skip_llm:
+            try:
+                recommendations = self._rank_with_llm(
+                    participants,
+                    full_movies,
+                    num_recommendations
+                )
+                model_used = ModelProvider.GROQ
+
+            except Exception as e:
+                logger.warning("Groq failed with error: %s, falling back to fairness-only results", e)
+
+        # Groq hatasıyla düşülen fallback cache'lenmez (Groq düzelince yeniden denensin)
+        llm_failed = not skip_llm and recommendations is None
+        if recommendations is None:
             # Fallback: Use fairness results directly
-            recommendations = []
-            for movie in full_movies[:num_recommendations]:
-                individual = movie.get("individual_scores", {})
-                why_parts = []
-                for name, score in individual.items():
-                    pct = int(score * 100)
-                    why_parts.append(f"{name}: {pct}%")
-                why = f"Fair match - {', '.join(why_parts)}" if why_parts else "Recommended based on group preferences"
-
-                recommendations.append(MovieRecommendation(
-                    id=movie["id"],
-                    title=movie["title"],
-                    why=why,
-                    poster_url=movie.get("poster_url"),
-                    overview=movie.get("overview"),
-                    vote_average=movie.get("vote_average"),
-                    release_year=movie.get("release_year"),
-                    genres=movie.get("genres", []),
-                    trailer_key=movie.get("trailer_key")
-                ))
+            recommendations = self._fallback_recs(full_movies, num_recommendations)
             model_used = ModelProvider.EMBEDDING_ONLY
 
         elapsed_ms = int((time.time() - start_time) * 1000)
 
         # Get fairness stats and convert to Pydantic model
+        # (fair_candidates is sorted by fair_score, so the slice is the top-k)
         fairness_stats_dict = self.fair_recommender.get_fairness_stats(
             fair_candidates[:num_recommendations],
             participants_dict
@@ -120,7 +280,7 @@ class ModelGateway:
                 most_satisfied=fairness_stats_dict.get("most_satisfied")
             )
 
-        return GatewayResponse(
+        response = GatewayResponse(
             recommendations=recommendations,
             model_used=model_used,
             response_time_ms=elapsed_ms,
@@ -129,6 +289,9 @@ class ModelGateway:
             fairness_stats=fairness_stats,
             feedback_applied=False
         )
+        if not llm_failed:
+            self.response_cache.put(participants, [], [response], **response_key)
+        return response
 
     def recommend_with_feedback(
         self,
@@ -150,18 +313,10 @@ class ModelGateway:
         start_time = time.time()
 
         # Convert Pydantic models to dicts
-        participants_dict = [
-            {
-                "name": p.name,
-                "moods": p.moods,
-                "note": p.note or ""
-            }
-            for p in participants
-        ]
+        participants_dict = self._to_dicts(participants)
 
         # Get seen films count
-        seen_films = self.feedback_learner.get_seen_films(session_id)
-        seen_count = len(seen_films)
+        seen_count = len(self.feedback_learner.get_seen_films_set(session_id))
 
         # Get fair candidates WITH feedback integration
         fair_candidates = self.fair_recommender.recommend_fair_with_feedback(
@@ -176,20 +331,8 @@ class ModelGateway:
         # Check if feedback was applied
         feedback_applied = any(c.get("feedback_applied", False) for c in fair_candidates)
 
-        # Get full movie details
-        movie_ids = [c["movie_id"] for c in fair_candidates]
-        full_movies = self.movie_repo.get_movies_by_ids(movie_ids)
-
-        # Add scores to movies
-        for movie in full_movies:
-            for c in fair_candidates:
-                if c["movie_id"] == movie["id"]:
-                    movie["similarity"] = c["fair_score"]
-                    movie["fair_score"] = c["fair_score"]
-                    movie["avg_score"] = c["avg_score"]
-                    movie["min_score"] = c["min_score"]
-                    movie["individual_scores"] = c["individual_scores"]
-                    break
+        # Get full movie details (with fairness scores)
+        full_movies = self._movies_with_scores(fair_candidates)
 
         # Build swipe history for Groq prompt (round 2+)
         swipe_history = None
@@ -198,7 +341,7 @@ class ModelGateway:
 
         # Send to LLM for final ranking
         try:
-            recommendations = self.groq.recommend_from_candidates_movies(
+            recommendations = self._rank_with_llm(
                 participants,
                 full_movies,
                 num_recommendations,
@@ -208,27 +351,8 @@ class ModelGateway:
             model_used = ModelProvider.GROQ
 
         except Exception as e:
-            print(f"Groq failed with error: {e}, falling back to fairness-only results")
-            recommendations = []
-            for movie in full_movies[:num_recommendations]:
-                individual = movie.get("individual_scores", {})
-                why_parts = []
-                for name, score in individual.items():
-                    pct = int(score * 100)
-                    why_parts.append(f"{name}: {pct}%")
-                why = f"Fair match - {', '.join(why_parts)}" if why_parts else "Recommended based on group preferences"
-
-                recommendations.append(MovieRecommendation(
-                    id=movie["id"],
-                    title=movie["title"],
-                    why=why,
-                    poster_url=movie.get("poster_url"),
-                    overview=movie.get("overview"),
-                    vote_average=movie.get("vote_average"),
-                    release_year=movie.get("release_year"),
-                    genres=movie.get("genres", []),
-                    trailer_key=movie.get("trailer_key")
-                ))
+            logger.warning("Groq failed with error: %s, falling back to fairness-only results", e)
+            recommendations = self._fallback_recs(full_movies, num_recommendations)
             model_used = ModelProvider.EMBEDDING_ONLY
 
         elapsed_ms = int((time.time() - start_time) * 1000)
@@ -269,28 +393,30 @@ class ModelGateway:
         """
         swipe_history = {}
 
+        # Collect every needed id first so the repo is hit only once
+        user_ids = {}
+        all_ids = set()
         for user in participants:
             user_name = user.get("name", "User")
-            swipes = self.feedback_learner.get_user_swipes(session_id, user_name)
+            liked_ids = self.feedback_learner.get_user_movie_ids(session_id, user_name, "like")[:5]  # Limit to 5 for prompt size
+            disliked_ids = self.feedback_learner.get_user_movie_ids(session_id, user_name, "dislike")[:5]
 
-            if not swipes:
+            if not liked_ids and not disliked_ids:
                 continue
+            user_ids[user_name] = (liked_ids, disliked_ids)
+            all_ids.update(liked_ids)
+            all_ids.update(disliked_ids)
 
-            liked_ids = [s["movie_id"] for s in swipes if s["action"] == "like"]
-            disliked_ids = [s["movie_id"] for s in swipes if s["action"] == "dislike"]
+        movies = {m["id"]: m for m in self.movie_repo.get_movies_by_ids(list(all_ids))}
 
+        for user_name, (liked_ids, disliked_ids) in user_ids.items():
             # Get movie titles for context
-            liked_titles = []
-            for movie_id in liked_ids[:5]:  # Limit to 5 for prompt size
-                movie = self.movie_repo.get_movie_by_id(movie_id)
-                if movie:
-                    liked_titles.append(movie.get("title", str(movie_id)))
-
-            disliked_titles = []
-            for movie_id in disliked_ids[:5]:
-                movie = self.movie_repo.get_movie_by_id(movie_id)
-                if movie:
-                    disliked_titles.append(movie.get("title", str(movie_id)))
+            liked_titles = [
+                movies[mid].get("title", str(mid)) for mid in liked_ids if mid in movies
+            ]
+            disliked_titles = [
+                movies[mid].get("title", str(mid)) for mid in disliked_ids if mid in movies
+            ]
 
             if liked_titles or disliked_titles:
                 swipe_history[user_name] = {
@@ -327,9 +453,18 @@ class ModelGateway:
         return self.feedback_learner.get_session_stats(session_id)
 
     def get_seen_films(self, session_id: str) -> list[int]:
-        """Session'da görülen filmleri al"""
+        """Session'da görülen filmleri al (API boundary, list)"""
         return self.feedback_learner.get_seen_films(session_id)
 
+    def embedding_query_cache_info(self) -> dict | None:
+        """Query embedding LRU istatistikleri; engine henüz yüklenmediyse None (yüklemeyi tetiklemez)"""
+        engine = self.__dict__.get("embedding_engine")
+        return engine.query_cache_info() if engine is not None else None
+
+    def get_session_snapshot(self, session_id: str) -> tuple[dict, list[int]]:
+        """(stats, seen_films) tek çağrıda; endpoint'ler session'a bir kez gider"""
+        return self.feedback_learner.get_session_snapshot(session_id)
+
     def clear_session(self, session_id: str) -> bool:
         """Session verilerini temizle"""
         return self.feedback_learner.clear_session(session_id)
@@ -347,33 +482,22 @@ class ModelGateway:
         # Get raw match data from feedback learner
         raw_matches = self.feedback_learner.calculate_matches(session_id)
 
-        # Enrich with movie details
-        enriched = {"perfect": [], "majority": []}
+        # Enrich with movie details (one batched repo lookup for both buckets)
+        ids = {
+            m["movie_id"]
+            for bucket in ("perfect", "majority")
+            for m in raw_matches.get(bucket, [])
+        }
+        movies = {m["id"]: m for m in self.movie_repo.get_movies_by_ids(list(ids))}
 
-        for match in raw_matches.get("perfect", []):
-            movie = self.movie_repo.get_movie_by_id(match["movie_id"])
-            if movie:
-                enriched["perfect"].append({
-                    **match,
-                    "title": movie.get("title"),
-                    "poster_url": movie.get("poster_url"),
-                    "overview": movie.get("overview"),
-                    "vote_average": movie.get("vote_average"),
-                    "genres": movie.get("genres", []),
-                    "trailer_key": movie.get("trailer_key")
-                })
-
-        for match in raw_matches.get("majority", []):
-            movie = self.movie_repo.get_movie_by_id(match["movie_id"])
-            if movie:
-                enriched["majority"].append({
-                    **match,
-                    "title": movie.get("title"),
-                    "poster_url": movie.get("poster_url"),
-                    "overview": movie.get("overview"),
-                    "vote_average": movie.get("vote_average"),
-                    "genres": movie.get("genres", []),
-                    "trailer_key": movie.get("trailer_key")
-                })
+        enriched = {"perfect": [], "majority": []}
+        for bucket in ("perfect", "majority"):
+            for match in raw_matches.get(bucket, []):
+                movie = movies.get(match["movie_id"])
+                if movie:
+                    enriched[bucket].append({
+                        **match,
+                        **_match_details(movie)
+                    })
 
         return enriched
@@ -1,20 +1,36 @@
+import functools
 import os
+import numpy as np
 from groq import Groq
 from .types import ParticipantPreference, MovieRecommendation
-import json
+from data.movie_repository import load_movies
+from .http_pool import sync_http_client
+from .stream_parse import stream_recommendations
 class GroqClient:
 
     def __init__(self):
         self.api_key = os.getenv("GROQ_API_KEY")
-        self.client= Groq(api_key=self.api_key)
+        self.client= Groq(api_key=self.api_key, http_client=sync_http_client())
         self.movies = self._load_movies()
+        self._static_prefix = self._build_static_prefix()
 
     def _load_movies(self) -> list[dict]:
         """Load movie dataset from a local JSON file"""
         current_dir = os.path.dirname(os.path.abspath(__file__))
         movies_path = os.path.join(current_dir, "..", "data", "movies.json")
-        with open(movies_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        movies = load_movies(movies_path)
+
+        # O(1) lookup indexes for _find_movie (first occurrence wins, like the old scan)
+        self._by_id = {}
+        self._by_title = {}
+        for movie in movies:
+            self._by_id.setdefault(movie['id'], movie)
+            self._by_title.setdefault(movie['title'].lower().strip(), movie)
+        # Partial-match fallback için lowercase başlıklar (movies ile aynı sırada)
+        self._lower_titles = [m['title'].lower() for m in movies]
+        # Trailer'ı olan film id'leri (katalog özelliği, prompt filtresi için bir kez)
+        self._trailer_ids = frozenset(m['id'] for m in movies if m.get('trailer_key'))
+        return movies
 
 
     def recommend_from_candidates_movies(
@@ -35,22 +51,28 @@ class GroqClient:
             swipe_history: Optional swipe history for feedback-aware recommendations
                           Format: {user_name: {"likes": [titles], "dislikes": [titles]}}
             round_num: Which round of recommendations (1 = first, 2+ = with feedback)
+
+        Not cached here: ModelGateway._rank_with_llm wraps every call with a
+        RecommendationCache keyed on per-participant (name, moods, note), candidate ids,
+        n, round and swipe history.
         """
         prompt = self._build_prompt_with_candidates(
             participants, candidate_movies, num_recommendations,
             swipe_history=swipe_history, round_num=round_num
         )
-        response = self.client.chat.completions.create(
+        stream = self.client.chat.completions.create(
             model="llama-3.1-8b-instant",
-            messages=[{"role": "user", "content": prompt}],
+            messages=[
+                {"role": "system", "content": self._static_prefix},
+                {"role": "user", "content": prompt}
+            ],
             max_tokens=1000,
-            temperature=0.7
+            temperature=0.7,
+            stream=True
         )
-        content = response.choices[0].message.content
-        if content is None:
-            return []
-        recommendations = self._parse_response(content)
-        return recommendations
+
+        # Her obje gelir gelmez parse edilir; kalan token'lar beklenmez
+        return stream_recommendations(stream, self._find_movie, num_recommendations)
         
         
 
@@ -90,6 +112,38 @@ class GroqClient:
         "heartwarming": ["Drama", "Comedy", "Family", "Romance"],
     }
 
+    def _build_static_prefix(self) -> str:
+        """
+        Request'ten bağımsız kısım (header, tüm mood tanımları, kurallar, format).
+        Her çağrıda birebir aynı olduğu için provider prefix cache'ine düşer.
+        """
+        mood_explanations = [
+            f'"{mood}" = {definition}' for mood, definition in self.MOOD_DEFINITIONS.items()
+        ]
+        return f"""You are a movie recommendation expert.
+        A group wants to watch a movie together.
+
+        MOOD DEFINITIONS (interpret these correctly):
+        {chr(10).join(mood_explanations)}
+
+        CRITICAL RULES:
+        1. If "funny" is requested, prioritize COMEDY genre movies
+        2. If "dark" is requested, DO NOT default to Horror - prefer psychological dramas, noir, crime
+        3. The "why" field MUST accurately describe the movie's actual genre and tone
+        4. DO NOT say "romance" for war films or "comedy" for dramas
+        5. ONLY choose movies from the "Available movies" list in the user message
+
+        Return ONLY valid JSON array with movie IDs: [{{"id": 12345, "title": "Movie Name", "why": "Reason"}}]
+        """
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _preferred_genres(moods: frozenset) -> frozenset:
+        """Bilinen mood kümesi -> tercih edilen genre'ler (aynı mood grubu tekrar hesaplanmaz)"""
+        return frozenset(
+            g for mood in moods for g in GroqClient.MOOD_GENRE_PREFERENCES[mood]
+        )
+
     def _build_prompt_with_candidates(
         self,
         participants: list[ParticipantPreference],
@@ -98,156 +152,99 @@ class GroqClient:
         swipe_history: dict | None = None,
         round_num: int = 1
     ) -> str:
-        """Build prompt with optional swipe history for feedback-aware recommendations."""
+        """Build the per-request prompt (participants, swipe history, candidates); sent after self._static_prefix."""
         # Only include movies that have trailers
-        movies_with_trailers = [m for m in candidate_movies if m.get('trailer_key')]
+        movies_with_trailers = [m for m in candidate_movies if m['id'] in self._trailer_ids]
 
-        # Collect all moods from participants
-        all_moods = set()
-        for p in participants:
-            all_moods.update(p.moods)
+        # Collect all moods from participants (sadece genre tercihi olan bilinen mood'lar)
+        known_moods = self.MOOD_GENRE_PREFERENCES
+        moods_key = frozenset(
+            mood for mood in (m.lower() for p in participants for m in p.moods)
+            if mood in known_moods
+        )
 
         # Get preferred genres based on moods
-        preferred_genres = set()
-        for mood in all_moods:
-            genres = self.MOOD_GENRE_PREFERENCES.get(mood.lower(), [])
-            preferred_genres.update(genres)
+        preferred_genres = self._preferred_genres(moods_key)
 
         # Sort movies: preferred genres first, then by rating
-        def movie_sort_key(m):
-            has_preferred = any(g in preferred_genres for g in m.get('genres', []))
-            rating = m.get('vote_average', 0) or 0
-            return (not has_preferred, -rating)  # False < True, so preferred comes first
-
-        sorted_movies = sorted(movies_with_trailers, key=movie_sort_key)
-
-        movie_list = "\n".join([
-            f"- ID:{m['id']} | {m['title']} | {', '.join(m['genres'])} | Rating:{m['vote_average']}"
-            for m in sorted_movies[:30]  # First 30 movies with trailers
-        ])
-
-        # Build mood definitions for the prompt
-        mood_explanations = []
-        for mood in all_moods:
-            definition = self.MOOD_DEFINITIONS.get(mood.lower())
-            if definition:
-                mood_explanations.append(f'"{mood}" = {definition}')
-
-        prompt = f"""You are a movie recommendation expert.
-        A group wants to watch a movie together.
-
-        MOOD DEFINITIONS (interpret these correctly):
-        {chr(10).join(mood_explanations)}
+        # (lexsort is stable: last key is primary, ties keep candidate order like sorted())
+        n = len(movies_with_trailers)
+        not_preferred = np.fromiter(
+            (preferred_genres.isdisjoint(m.get('genres', [])) for m in movies_with_trailers),
+            dtype=np.int8, count=n
+        )
+        neg_ratings = np.fromiter(
+            (-(m.get('vote_average', 0) or 0) for m in movies_with_trailers),
+            dtype=np.float64, count=n
+        )
+        order = np.lexsort((neg_ratings, not_preferred))[:30]  # First 30 movies with trailers
 
-        Participants:
-        """
+        # Tek join ile birleştir (döngüde prompt += yerine)
+        parts = ["Participants:\n"]
         for participant in participants:
-            prompt += f"- {participant.name}: wants {', '.join(participant.moods)} movies"
+            parts.append(f"- {participant.name}: wants {', '.join(participant.moods)} movies")
             if participant.note:
-                prompt += f". Note: \"{participant.note}\""
-            prompt += "\n"
+                parts.append(f". Note: \"{participant.note}\"")
+            parts.append("\n")
 
         # Add swipe history context for round 2+
         if round_num > 1 and swipe_history:
-            prompt += "\n        Previous swipe history (use this to improve recommendations):\n"
+            parts.append("\n        Previous swipe history (use this to improve recommendations):\n")
             for user_name, history in swipe_history.items():
                 likes = history.get("likes", [])
                 dislikes = history.get("dislikes", [])
                 if likes or dislikes:
-                    prompt += f"        {user_name}:\n"
+                    parts.append(f"        {user_name}:\n")
                     if likes:
-                        prompt += f"          Liked: {', '.join(likes[:5])}\n"
+                        parts.append(f"          Liked: {', '.join(likes[:5])}\n")
                     if dislikes:
-                        prompt += f"          Disliked: {', '.join(dislikes[:5])}\n"
+                        parts.append(f"          Disliked: {', '.join(dislikes[:5])}\n")
 
-            prompt += """
+            parts.append("""
         IMPORTANT: Based on the swipe history above:
         - Recommend movies SIMILAR to liked ones
         - AVOID movies similar to disliked ones
         - The group has already seen some movies, so suggest fresh picks
-        """
+        """)
 
-        prompt += f"""
+        parts.append("""
         Available movies (ONLY choose from this list):
-        {movie_list}
-
-        CRITICAL RULES:
-        1. If "funny" is requested, prioritize COMEDY genre movies
-        2. If "dark" is requested, DO NOT default to Horror - prefer psychological dramas, noir, crime
-        3. The "why" field MUST accurately describe the movie's actual genre and tone
-        4. DO NOT say "romance" for war films or "comedy" for dramas
+        """)
+        parts.append("\n".join(
+            f"- ID:{m['id']} | {m['title']} | {', '.join(m['genres'])} | Rating:{m['vote_average']}"
+            for m in (movies_with_trailers[i] for i in order)
+        ))
+        parts.append(f"""
 
         Recommend {num_recommendations} movies that would satisfy everyone.
-        Return ONLY valid JSON array with movie IDs: [{{"id": 12345, "title": "Movie Name", "why": "Reason"}}]
         IMPORTANT: You MUST include the exact ID from the list above for each movie.
+        """)
+        return "".join(parts)
 
-        """
-        return prompt
     def _find_movie_by_id(self, movie_id: int) -> dict | None:
         """Find a movie in the database by ID"""
-        for movie in self.movies:
-            if movie['id'] == movie_id:
-                return movie
-        return None
+        return self._by_id.get(movie_id)
 
     def _find_movie_by_title(self, title: str) -> dict | None:
         """Find a movie in the database by title (fuzzy match)"""
         title_lower = title.lower().strip()
         # Exact match first
-        for movie in self.movies:
-            if movie['title'].lower().strip() == title_lower:
-                return movie
+        movie = self._by_title.get(title_lower)
+        if movie:
+            return movie
         # Partial match fallback
-        for movie in self.movies:
-            if title_lower in movie['title'].lower() or movie['title'].lower() in title_lower:
+        for movie, movie_title in zip(self.movies, self._lower_titles):
+            if title_lower in movie_title or movie_title in title_lower:
                 return movie
         return None
 
-    def _parse_response(self, response_content: str) -> list[MovieRecommendation]:
-        try:
-            # JSON'u bul (bazen AI ekstra text ekler)
-            start = response_content.find('[')
-            end = response_content.rfind(']') + 1
-            if start == -1 or end == 0:
-                return []
-            json_str = response_content[start:end]
-            data = json.loads(json_str)
-
-            recommendations = []
-            for item in data:
-                movie_id = item.get("id", 0)
-                title = item.get('title', '')
-                why = item.get('why', '')
-
-                # Önce ID ile bul
-                movie_data = self._find_movie_by_id(movie_id)
-
-                # ID bulunamazsa title ile ara
-                if not movie_data and title:
-                    movie_data = self._find_movie_by_title(title)
-
-                if movie_data:
-                    recommendation = MovieRecommendation(
-                        id=movie_data['id'],
-                        title=movie_data['title'],
-                        why=why,
-                        poster_url=movie_data.get('poster_url'),
-                        overview=movie_data.get('overview'),
-                        vote_average=movie_data.get('vote_average'),
-                        release_year=movie_data.get('release_year'),
-                        genres=movie_data.get('genres', []),
-                        trailer_key=movie_data.get('trailer_key')
-                    )
-                else:
-                    # Fallback if movie not found
-                    recommendation = MovieRecommendation(
-                        id=0,
-                        title=title,
-                        why=why,
-                        genres=[]
-                    )
-                recommendations.append(recommendation)
-            return recommendations
-        except json.JSONDecodeError:
-            return []
-    
+    def _find_movie(self, item: dict) -> dict | None:
+        """Catalog movie for one parsed {"id", "title", "why"} object"""
+        # Önce ID ile bul
+        movie_data = self._find_movie_by_id(item.get("id", 0))
+
+        # ID bulunamazsa title ile ara
+        title = item.get('title', '')
+        if not movie_data and title:
+            movie_data = self._find_movie_by_title(title)
+        return movie_data
@@ -0,0 +1,29 @@
+"""
+Shared HTTP connection pools for the LLM clients.
+
+Her client objesi kendi bağlantısını açmak yerine process başına tek bir
+pool kullanır; TLS handshake'leri istekler arasında amortize edilir,
+HTTP/2 destekleyen sunucularda istekler aynı bağlantıda multiplex edilir.
+"""
+
+import atexit
+import functools
+
+import httpx
+
+_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+
+@functools.lru_cache(maxsize=1)
+def sync_http_client() -> httpx.Client:
+    """Process-wide pooled client for sync SDKs (Groq, DeepSeek via OpenAI)"""
+    client = httpx.Client(http2=True, limits=_LIMITS)
+    atexit.register(client.close)
+    return client
+
+
+async def aclose_http_clients() -> None:
+    """Close pools that were actually created (FastAPI lifespan shutdown)"""
+    if sync_http_client.cache_info().currsize:
+        sync_http_client().close()
+        sync_http_client.cache_clear()
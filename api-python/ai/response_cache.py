@@ -0,0 +1,110 @@
+"""
+Response cache for LLM recommendation calls.
+
+LLM çağrısı pipeline'daki en pahalı adım; aynı grup isteği tekrar
+geldiğinde network round-trip'i tamamen atlıyoruz.
+
+Sadece exact hit: katılımcı başına (isim, mood'lar, normalize note) + candidate ids, ...
+hash'i birebir aynı olmalı. Semantic (benzer note) eşleşme yok: cevaptaki "why" metinleri
+ve fairness skorları note'a göre üretiliyor, başka bir note'a dönmemeli.
+
+İsimler key'in parçası: prompt isimleri içeriyor, cache'ten dönen "why" metinleri
+başka bir grubun isimlerini taşımamalı.
+
+Key'e movies.json versiyonu da girer, katalog değişince cache kendiliğinden geçersiz olur.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def catalog_version(json_path: str) -> str:
+    """movies.json içeriğinin kısa hash'i (cache invalidation için)"""
+    try:
+        with open(json_path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()[:16]
+    except FileNotFoundError:
+        return ""
+
+
+class RecommendationCache:
+    """Size-capped LRU cache for recommendation lists (exact keys, optional TTL)."""
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        version: str = "",
+        ttl: Optional[float] = None
+    ):
+        """
+        Args:
+            maxsize: Max cached responses (oldest evicted first)
+            version: Catalog version, her key'e eklenir
+            ttl: Saniye; None ise entry'ler sadece LRU ile düşer
+        """
+        self.maxsize = maxsize
+        self.version = version
+        self.ttl = ttl
+        # exact_key -> (recommendations, expires_at)
+        self._entries: OrderedDict[str, tuple[list, float]] = OrderedDict()
+        # Gateway request thread'lerinden paralel erişim
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(payload) -> str:
+        raw = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha1(raw).hexdigest()
+
+    def _key(self, participants, candidate_ids, extra: dict) -> str:
+        people = sorted(
+            (p.name, sorted(m.lower() for m in p.moods), " ".join(p.note.lower().split()) if p.note else "")
+            for p in participants
+        )
+        return self._digest({
+            "version": self.version,
+            "people": people,
+            "candidates": sorted(candidate_ids),
+            **extra
+        })
+
+    def key(self, participants, candidate_ids, **extra) -> str:
+        """Exact-match key of a request (same one get/put use)"""
+        return self._key(participants, candidate_ids, extra)
+
+    def get(self, participants, candidate_ids, **extra) -> Optional[list]:
+        """Cached recommendations or None"""
+        key = self._key(participants, candidate_ids, extra)
+        with self._lock:
+            if self.ttl is not None:
+                self._evict_expired()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return list(entry[0])
+
+    def put(self, participants, candidate_ids, recommendations: list, **extra) -> None:
+        """Store a non-empty recommendation list"""
+        if not recommendations:
+            return
+        key = self._key(participants, candidate_ids, extra)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (list(recommendations), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry[1] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,132 @@
+"""
+Incremental parser for streamed LLM output.
+
+LLM'ler cevabı token token gönderirken JSON array'in her objesini
+tamamlandığı anda çıkarır; tüm cevabın bitmesini beklemeye gerek kalmaz.
+Array'den önceki açıklama metni ('Here are...') yok sayılır.
+
+stream_recommendations: Groq ve DeepSeek client'larının ortak streaming döngüsü
+(chunk -> JsonArrayStream -> MovieRecommendation).
+"""
+
+from typing import Callable, Optional
+
+import orjson
+
+from .types import MovieRecommendation
+
+
+class JsonArrayStream:
+    """Feed text chunks, get back each top-level object of the first JSON array as it completes."""
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = -1
+        self._n_items = 0
+        self.done = False  # closing ']' of the array seen
+
+    def feed(self, chunk: str) -> list[dict]:
+        """Append a chunk and return objects completed by it"""
+        text = self._text + chunk
+        items = []
+        i = self._pos
+
+        while i < len(text) and not self.done:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                # Array başlamadan önceki metin
+                if ch == "[":
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                if self._depth == 1 and ch == "{":
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 1 and ch == "}" and self._obj_start >= 0:
+                    try:
+                        items.append(orjson.loads(text[self._obj_start:i + 1]))
+                        self._n_items += 1
+                    except orjson.JSONDecodeError:
+                        pass  # bozuk obje, sonrakilerle devam
+                    self._obj_start = -1
+                elif self._depth == 0 and self._n_items:
+                    # Obje içermeyen '[...]' (ör. metindeki köşeli parantez) array sayılmaz
+                    self.done = True
+            i += 1
+
+        # Sadece yarım kalan objeyi tut, işlenmiş metni at
+        keep_from = self._obj_start if self._obj_start >= 0 else i
+        self._text = text[keep_from:]
+        self._pos = i - keep_from
+        if self._obj_start >= 0:
+            self._obj_start = 0
+        return items
+
+
+def stream_recommendations(
+    stream,
+    find_movie: Callable[[dict], Optional[dict]],
+    limit: int
+) -> list[MovieRecommendation]:
+    """
+    Streamed chat completion -> first `limit` recommendations.
+
+    Her obje gelir gelmez parse edilip find_movie ile katalogdaki filme eşlenir;
+    array kapanınca (veya yeterli film olunca) stream kapatılır, kalan token'lar beklenmez.
+    """
+    parser = JsonArrayStream()
+    recommendations = []
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            for item in parser.feed(delta):
+                recommendations.append(to_recommendation(item, find_movie(item)))
+            if parser.done or len(recommendations) >= limit:
+                break
+    finally:
+        stream.close()
+    return recommendations[:limit]
+
+
+def to_recommendation(item: dict, movie_data: Optional[dict]) -> MovieRecommendation:
+    """One parsed {"title", "why"} item + its catalog movie (None if not found) -> MovieRecommendation"""
+    title = item.get('title', '')
+    why = item.get('why', '')
+
+    if movie_data:
+        return MovieRecommendation(
+            id=movie_data['id'],
+            title=movie_data['title'],
+            why=why,
+            poster_url=movie_data.get('poster_url'),
+            overview=movie_data.get('overview'),
+            vote_average=movie_data.get('vote_average'),
+            release_year=movie_data.get('release_year'),
+            genres=movie_data.get('genres', []),
+            trailer_key=movie_data.get('trailer_key')
+        )
+    # Fallback if movie not found
+    return MovieRecommendation(
+        id=0,
+        title=title,
+        why=why,
+        genres=[]
+    )
@@ -1,21 +1,38 @@
-import json
+import functools
+import os
+import orjson
+
+
+@functools.lru_cache(maxsize=None)
+def _load_movies_cached(abs_path: str) -> list[dict]:
+    with open(abs_path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def load_movies(json_path: str) -> list[dict]:
+    """Parse a movies JSON file once per process.
+
+    MovieRepository, GroqClient and DeepseekClient all share the same list,
+    so the catalog is decoded and held in memory only once. Treat it as read-only.
+    """
+    return _load_movies_cached(os.path.abspath(json_path))
+
 
 class MovieRepository():
     """It reads movie from a JSON file and provides access methods by ID """
 
     def __init__(self,json_path: str):
         self.json_path=json_path
+        # movies_list, load_movies'in process genelinde paylaşılan listesi (kopya değil);
+        # sadece id index'i bu instance'a ait
         self.movies_list= self. _load_movies()
-        self.movies ={}
-        for movie in self.movies_list:
-            self.movies[movie["id"]] = movie
+        self.movies = {movie["id"]: movie for movie in self.movies_list}
 
 
     def _load_movies(self):
         """Load movies from the JSON file."""
         try:
-            with open(self.json_path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return load_movies(self.json_path)
         except FileNotFoundError:
             return []
 
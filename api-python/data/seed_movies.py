@@ -1,41 +1,48 @@
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from tmdb_client import TMDBClient
 load_dotenv()
 """Script to seed movies data from TMDB into a JSON file"""
 
-def seed_movies(num_pages: int =50, include_trailers: bool = True):
+def seed_movies(num_pages: int =50, include_trailers: bool = True, max_workers: int = 8):
     """Fetch popular movies from TMDB and save to movies.json
     Args:
         num_pages(int): Number of pages to fetch (20 movies per page)
-        include_trailers(bool): Whether to fetch trailer keys (slower but complete)"""
+        include_trailers(bool): Whether to fetch trailer keys (slower but complete)
+        max_workers(int): Parallel trailer fetches (client rate limit still applies)"""
     tmdb_client= TMDBClient()
-    all_movies= []
-    seen_ids = set()
-    for page in range(1,num_pages+1):
-        print(f" Page {page}/{num_pages}...")
-        raw_movies= tmdb_client.get_popular_movies(page=page)
+    # Hata olsa da pooled HTTP bağlantısı ve disk cache kapansın
+    try:
+        all_movies= []
+        seen_ids = set()
+        for page in range(1,num_pages+1):
+            print(f" Page {page}/{num_pages}...")
+            raw_movies= tmdb_client.get_popular_movies(page=page)
                   
-        for i, raw_movie in enumerate(raw_movies):
-            if raw_movie["id"] in seen_ids:
-                continue
-            seen_ids.add(raw_movie["id"])
-            movie= tmdb_client.transform_movie(raw_movie)
+            for raw_movie in raw_movies:
+                if raw_movie["id"] in seen_ids:
+                    continue
+                seen_ids.add(raw_movie["id"])
+                all_movies.append(tmdb_client.transform_movie(raw_movie))
 
-            # Fetch trailer if enabled
-            if include_trailers:
-                movie_id = raw_movie.get("id")
-                if movie_id:
-                    trailer_key = tmdb_client.get_movie_trailer(movie_id)
+        # Fetch trailers if enabled
+        # Seri round-trip yerine paralel; TMDBClient rate limiter'ı 4 rps'i korur
+        if include_trailers:
+            with_ids = [m for m in all_movies if m.get("id")]
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                trailer_keys = pool.map(tmdb_client.get_movie_trailer, [m["id"] for m in with_ids])
+                for i, (movie, trailer_key) in enumerate(zip(with_ids, trailer_keys)):
                     movie["trailer_key"] = trailer_key
-                    print(f"   [{(page-1)*20 + i + 1}] {movie['title']} - trailer: {'✓' if trailer_key else '✗'}")
-
-            all_movies.append(movie)
+                    print(f"   [{i + 1}] {movie['title']} - trailer: {'✓' if trailer_key else '✗'}")
+    finally:
+        tmdb_client.close()
 
     #save to movies.json
     output_path= "movies.json"
-    with open (output_path,"w",encoding="utf-8") as f:
-        json.dump(all_movies,f,indent=2,ensure_ascii=False)
+    # orjson: load_movies da orjson ile okuyor; aynı format, UTF-8, indent=2
+    with open (output_path,"wb") as f:
+        f.write(orjson.dumps(all_movies, option=orjson.OPT_INDENT_2))
 
     movies_with_trailers = sum(1 for m in all_movies if m.get("trailer_key"))
     print(f"\nSaved {len(all_movies)} movies to {output_path}")
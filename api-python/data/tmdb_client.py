@@ -1,114 +1,183 @@
 import os
+import json
+import sqlite3
 import httpx
-from typing import Optional
+import orjson
+from typing import Any, Optional
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+_MISS = object()
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tmdb_cache.sqlite")
+# Trailer dil fallback'leri için process genelinde tek pool (en-US miss başına yeni pool yok);
+# thread'ler ilk submit'te açılır, eşzamanlı istek hızını yine rate limiter belirler
+_TRAILER_FALLBACK_POOL = ThreadPoolExecutor(max_workers=7, thread_name_prefix="tmdb-trailer")
+
+
+class TMDBDiskCache:
+    """Small sqlite key-value cache (JSON values, optional TTL), safe to share across threads"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, expire: Optional[float] = None) -> None:
+        expires = time.time() + expire if expire else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires)
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
 class TMDBClient:
     """TMDB API client with rate limiting"""
 
-    def __init__(self):
+    GENRE_TTL = 86400            # genre listesi nadiren değişir
+    TRAILER_MISS_TTL = 7 * 86400  # trailer'ı olmayan film sonradan eklenebilir; key'ler kalıcı
+
+    def __init__(self, cache_path: Optional[str] = DEFAULT_CACHE_PATH):
+        """cache_path=None: disk cache kapalı, her şey TMDB'den"""
+        self.cache = TMDBDiskCache(cache_path) if cache_path else None
         self.api_key = os.getenv("TMDB_API_KEY")
         self.base_url ="https://api.themoviedb.org/3"
         self.image_base_url ="https://image.tmdb.org/t/p/w500"
         self.last_request_time=0
         self.min_interval=0.25 # 4 requests per second
+        self._rate_lock = threading.Lock()
+        # Tek pooled HTTP/2 client: her istekte yeni TCP+TLS handshake yok
+        self._http = httpx.Client(
+            http2=True,
+            base_url=self.base_url,
+            params={"api_key": self.api_key},
+            timeout=10.0
+        )
         self.genre_map = self._fetch_genres()
 
     def _fetch_genres(self)->dict:
-        """ Fetch genre mapping from TMDB"""
-        url = f"{self.base_url}/genre/movie/list"
-        params={
-            "api_key":self.api_key,
-            "language":"en-US"
-        }
+        """ Fetch genre mapping from TMDB (disk cache'den, 1 gün geçerli)"""
+        if self.cache:
+            cached = self.cache.get("genres:en-US")
+            if cached is not None:
+                return {int(gid): name for gid, name in cached.items()}
+
+        params={"language":"en-US"}
         self._wait_for_rate_limit()
-        response= httpx.get(url,params=params)
+        response= self._http.get("/genre/movie/list",params=params)
         response.raise_for_status()
-        data=response.json()
-        return {genre["id"]:genre["name"] for genre in data.get("genres",[])}
+        data=orjson.loads(response.content)
+        genre_map = {genre["id"]:genre["name"] for genre in data.get("genres",[])}
+        if self.cache:
+            self.cache.set("genres:en-US", genre_map, expire=self.GENRE_TTL)
+        return genre_map
     
 
     def _wait_for_rate_limit(self):
-        """ensure we respect rate limits"""
-        elapsed= time.time()- self.last_request_time
-        if elapsed < self.min_interval:
-            time.sleep(self.min_interval- elapsed)
-        self.last_request_time= time.time()
+        """ensure we respect rate limits (thread-safe)
+
+        Her çağrı kendi başlangıç slot'unu lock altında ayırır, bekleme lock dışında;
+        paralel thread'lerde istekler 4 rps'te başlar ama round-trip'ler üst üste biner.
+        """
+        with self._rate_lock:
+            now = time.time()
+            slot = max(now, self.last_request_time + self.min_interval)
+            self.last_request_time = slot
+        if slot > now:
+            time.sleep(slot - now)
 
     def get_popular_movies(self, page:int=1) -> list[dict]:
         """Fetch popular movies from TMDB"""
-        url = f"{self.base_url}/movie/popular"
         params= {
-            "api_key": self.api_key,
             "language":"en-US",
             "page":page
         }
         self._wait_for_rate_limit()
-        response= httpx.get(url,params=params)
+        response= self._http.get("/movie/popular",params=params)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         return data.get("results",[])
     
     def get_movie_details(self,movie_id:int) -> Optional[dict]:
         """fetch detailed info for a specific movie"""
-        url= f"{self.base_url}/movie/{movie_id}"
-        params={
-            "api_key":self.api_key,
-            "language":"en-US"
-        }
+        params={"language":"en-US"}
         self._wait_for_rate_limit()
-        response = httpx.get(url,params=params)
+        response = self._http.get(f"/movie/{movie_id}",params=params)
         if response.status_code ==404:
             return None
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
 
-    def get_movie_trailer(self, movie_id: int) -> Optional[str]:
-        """Fetch YouTube trailer key for a movie, trying multiple languages"""
-        # Try different languages to find trailer
-        languages = ["en-US", "es-ES", "es-MX", "de-DE", "fr-FR", "ko-KR", "ja-JP", ""]
-
-        all_videos = []
-        for lang in languages:
-            url = f"{self.base_url}/movie/{movie_id}/videos"
-            params = {"api_key": self.api_key}
-            if lang:
-                params["language"] = lang
-
-            self._wait_for_rate_limit()
-            response = httpx.get(url, params=params)
-            if response.status_code == 404:
-                continue
-            response.raise_for_status()
-            data = response.json()
-            all_videos.extend(data.get("results", []))
-
-            # If we found videos, no need to try more languages
-            if all_videos:
-                break
-
-        # Remove duplicates by video key
-        seen_keys = set()
-        unique_videos = []
-        for video in all_videos:
-            key = video.get("key")
-            if key and key not in seen_keys:
-                seen_keys.add(key)
-                unique_videos.append(video)
+    TRAILER_LANGUAGES = ["en-US", "es-ES", "es-MX", "de-DE", "fr-FR", "ko-KR", "ja-JP", ""]
+
+    def _get_trailer_single_lang(self, movie_id: int, lang: str) -> Optional[str]:
+        """YouTube trailer key from one language's video list, None if there is none"""
+        params = {"language": lang} if lang else {}
+
+        self._wait_for_rate_limit()
+        response = self._http.get(f"/movie/{movie_id}/videos", params=params)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        videos = [v for v in orjson.loads(response.content).get("results", []) if v.get("site") == "YouTube" and v.get("key")]
 
         # Find YouTube trailer (prefer "Trailer" type, then "Teaser")
-        for video in unique_videos:
-            if video.get("site") == "YouTube" and video.get("type") == "Trailer":
-                return video.get("key")
-        # Fallback to teaser
-        for video in unique_videos:
-            if video.get("site") == "YouTube" and video.get("type") == "Teaser":
-                return video.get("key")
+        for video_type in ("Trailer", "Teaser"):
+            for video in videos:
+                if video.get("type") == video_type:
+                    return video["key"]
         # Fallback to any YouTube video
-        for video in unique_videos:
-            if video.get("site") == "YouTube":
-                return video.get("key")
-        return None
-    
+        return videos[0]["key"] if videos else None
+
+    def get_movie_trailer(self, movie_id: int) -> Optional[str]:
+        """Trailer key, disk cache'den; seed tekrar çalışınca görülen filmler için istek yok"""
+        cache_key = f"trailer:{movie_id}"
+        if self.cache:
+            cached = self.cache.get(cache_key, _MISS)
+            if cached is not _MISS:
+                return cached
+
+        key = self._fetch_movie_trailer(movie_id)
+        if self.cache:
+            self.cache.set(cache_key, key, expire=None if key else self.TRAILER_MISS_TTL)
+        return key
+
+    def _fetch_movie_trailer(self, movie_id: int) -> Optional[str]:
+        """Fetch YouTube trailer key for a movie, trying multiple languages
+
+        Önce sadece en-US (filmlerin çoğu burada çözülür); bulunamazsa diğer
+        diller paralel sorgulanır (rate limiter yine 4 rps'i korur) ve
+        öncelik sırasındaki ilk sonuç döner.
+        """
+        default_lang, *fallback_langs = self.TRAILER_LANGUAGES
+        key = self._get_trailer_single_lang(movie_id, default_lang)
+        if key:
+            return key
+
+        keys = _TRAILER_FALLBACK_POOL.map(lambda lang: self._get_trailer_single_lang(movie_id, lang), fallback_langs)
+        return next((k for k in keys if k), None)
+
+    def close(self) -> None:
+        """Close the pooled HTTP connection and the disk cache"""
+        self._http.close()
+        if self.cache:
+            self.cache.close()
+
     def transform_movie(self,raw_movie: dict) ->dict:
         """transform tmdb response to our schema"""
         #if genres_ids is present, we need to fetch genre names separetely
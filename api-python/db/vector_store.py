@@ -1,4 +1,6 @@
+import threading
 import chromadb
+import numpy as np
 from typing import Any
 
 
@@ -7,21 +9,59 @@ class MovieVectorStore:
 
     ChromaDB sadece arama indeksi olarak kullanılır.
     Tam film verileri (poster, trailer vs.) JSON'dan alınır.
+
+    Küçük kataloglarda id-only sorgular ChromaDB yerine bellekteki normalize
+    edilmiş embedding matrisi üzerinde exact inner product ile yapılır
+    (cosine ile aynı sonuç, HNSW + Python overhead'i yok). ChromaDB kalıcı kaynak.
     """
 
+    EXACT_SEARCH_MAX = 50_000  # üstünde ChromaDB HNSW'e bırak
+    # Embedding'ler ingestion'da L2-normalize ediliyor (EmbeddingEngine), inner product
+    # = cosine; distance yine 1 - similarity. Mevcut "cosine" collection'lar olduğu gibi açılır
+    # (metric sadece oluştururken seçilir), yeni / reseed edilenler "ip" olur
+    HNSW_SPACE = "ip"
+
     def __init__(self, db_path: str = "db/chroma"):
         self.client = chromadb.PersistentClient(path=db_path)
         self.collection = self.client.get_or_create_collection(
             name="movies",
-            metadata={"hnsw:space": "cosine"}
+            metadata={"hnsw:space": self.HNSW_SPACE}
         )
-
-    def add_movie_embedding(self, movies: list[dict], embeddings: list[list[float]]) -> None:
+        # Collection'daki id'lerin kopyası; movie_exists her seferinde DB'ye gitmesin
+        self._id_set: set[int] | None = None
+        # (ids, L2-normalized float32 matrix); False = katalog büyük, ChromaDB kullan
+        self._exact_index: tuple[np.ndarray, np.ndarray] | None | bool = None
+        self._exact_lock = threading.Lock()
+
+    def _ids(self) -> set[int]:
+        """Ingested movie ids, loaded from ChromaDB on first use"""
+        if self._id_set is None:
+            self._id_set = {int(i) for i in self.collection.get(include=[])["ids"]}
+        return self._id_set
+
+    def _get_exact_index(self):
+        """Collection'daki tüm embedding'leri bir kez yükle ve normalize et"""
+        if self._exact_index is None:
+            with self._exact_lock:
+                if self._exact_index is None:
+                    if self.collection.count() > self.EXACT_SEARCH_MAX:
+                        self._exact_index = False
+                    else:
+                        data = self.collection.get(include=["embeddings"])
+                        ids = np.array([int(i) for i in data["ids"]], dtype=np.int64)
+                        matrix = np.asarray(data["embeddings"], dtype=np.float32)
+                        if ids.size:
+                            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                            matrix = matrix / np.where(norms > 0, norms, 1.0)
+                        self._exact_index = (ids, matrix)
+        return self._exact_index
+
+    def add_movie_embedding(self, movies: list[dict], embeddings: "np.ndarray | list[list[float]]") -> None:
         """Add movies with their embeddings to the collection
 
         Args:
             movies: List of movie dicts (id, title, overview, genres)
-            embeddings: List of embedding vectors (384-dim each)
+            embeddings: (N, 384) float32 array or list of embedding vectors
         """
         ids = [str(m["id"]) for m in movies]
 
@@ -38,6 +78,9 @@ class MovieVectorStore:
             embeddings=embeddings,
             metadatas=metadatas
         )
+        if self._id_set is not None:
+            self._id_set.update(int(m["id"]) for m in movies)
+        self._exact_index = None
         print(f"Added {len(movies)} movies to vector store")
 
     def query_similar_movies(self, embedding: list[float], n_results: int = 20) -> list[dict]:
@@ -50,32 +93,93 @@ class MovieVectorStore:
         Returns:
             List of dicts with id, title, genres, similarity score
         """
+        return self.query_similar_movies_batch([embedding], n_results)[0]
+
+    def query_similar_movies_batch(self, embeddings: list[list[float]], n_results: int = 20) -> list[list[dict]]:
+        """Find similar movies for several query embeddings in one ChromaDB call
+
+        Args:
+            embeddings: query embedding vectors (ör. grup modunda kullanıcı başına bir tane)
+            n_results: number of results per query
+
+        Returns:
+            One result list per embedding, same order and format as query_similar_movies
+        """
+        if not embeddings:
+            return []
+
         results = self.collection.query(
-            query_embeddings=[embedding],
+            query_embeddings=embeddings,
             n_results=n_results,
             include=["metadatas", "distances"]
         )
 
-        similar_movies = []
-        for i, movie_id in enumerate(results['ids'][0]):
-            metadata = results["metadatas"][0][i]
-            distance = results["distances"][0][i]
+        batch = []
+        for ids, metadatas, distances in zip(results["ids"], results["metadatas"], results["distances"]):
+            similar_movies = []
+            for movie_id, metadata, distance in zip(ids, metadatas, distances):
+                similar_movies.append({
+                    "id": int(movie_id),
+                    "title": metadata["title"],
+                    "genres": metadata["genres"].split(",") if metadata["genres"] else [],
+                    "similarity": 1 - distance,
+                })
+            batch.append(similar_movies)
+        return batch
+
+    def query_similar_ids(self, embedding: list[float], n_results: int = 20) -> list[tuple[int, float]]:
+        """Lean query_similar_movies: only (movie_id, similarity), metadata is not fetched
+
+        Title/genre gerekiyorsa MovieRepository'den id ile alınır.
+        """
+        return self.query_similar_ids_batch([embedding], n_results)[0]
+
+    def query_similar_ids_batch(self, embeddings: list[list[float]], n_results: int = 20) -> list[list[tuple[int, float]]]:
+        """query_similar_ids for several embeddings in one call (in-memory exact search or ChromaDB)"""
+        if not embeddings:
+            return []
+
+        exact = self._get_exact_index()
+        if exact:
+            ids, matrix = exact
+            k = min(n_results, ids.size)
+            if k == 0:
+                return [[] for _ in embeddings]
+            queries = np.asarray(embeddings, dtype=np.float32)
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.where(norms > 0, norms, 1.0)
+            sims = queries @ matrix.T  # (Q, N) cosine similarity
+
+            # Top-k: argpartition ile seç, sadece k tanesini sırala
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_sims = np.take_along_axis(top_sims, order, axis=1)
+            return [
+                list(zip(ids[row].tolist(), row_sims.tolist()))
+                for row, row_sims in zip(top, top_sims)
+            ]
 
-            similar_movies.append({
-                "id": int(movie_id),
-                "title": metadata["title"],
-                "genres": metadata["genres"].split(",") if metadata["genres"] else [],
-                "similarity": 1 - distance,
-            })
-        return similar_movies
+        results = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=n_results,
+            include=["distances"]
+        )
+        return [
+            [(int(movie_id), 1 - distance) for movie_id, distance in zip(ids, distances)]
+            for ids, distances in zip(results["ids"], results["distances"])
+        ]
 
     def delete_all_movies(self) -> None:
         """Delete all movies from the collection"""
         self.client.delete_collection("movies")
         self.collection = self.client.get_or_create_collection(
             name="movies",
-            metadata={"hnsw:space": "cosine"}
+            metadata={"hnsw:space": self.HNSW_SPACE}
         )
+        self._id_set = set()
+        self._exact_index = None
         print("Deleted all movies from vector store")
 
     def get_count(self) -> int:
@@ -84,5 +188,4 @@ class MovieVectorStore:
 
     def movie_exists(self, movie_id: int) -> bool:
         """Check if a movie exists in the collection"""
-        result = self.collection.get(ids=[str(movie_id)])
-        return len(result["ids"]) > 0
\ No newline at end of file
+        return int(movie_id) in self._ids()
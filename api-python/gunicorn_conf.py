@@ -0,0 +1,34 @@
+"""
+Gunicorn config for production: gunicorn -c gunicorn_conf.py main:app
+
+UvicornWorker + uvicorn[standard] -> uvloop event loop ve httptools parser otomatik.
+
+Worker sayısı WEB_CONCURRENCY ile (default 1). Not: swipe / session state'i
+(FeedbackLearner) process içinde tutuluyor; birden fazla worker'da aynı session'ın
+istekleri farklı worker'lara düşer. WEB_CONCURRENCY > 1 sadece session'sız
+/recommendations trafiği için ya da sticky routing arkasında kullanılmalı.
+"""
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '7860')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+timeout = 120  # ilk istekler model yüklemesiyle çakışabilir
+keepalive = 5
+
+# App master'da import edilmez: model / ChromaDB / torch thread pool'ları fork
+# sonrası her worker'da kendi lifespan'inde yüklenir (fork + OpenMP deadlock'u yok)
+preload_app = False
+
+
+def on_starting(server):
+    """Seed'i fork'tan önce ayrı process'te bir kez yap; worker'lar aynı anda seed etmesin"""
+    subprocess.run([sys.executable, "startup.py"], check=True)
+
+
+def post_fork(server, worker):
+    """Worker başına torch thread'leri: core'lar worker'lar arasında paylaşılır"""
+    if workers > 1:
+        os.environ.setdefault("TORCH_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
@@ -1,24 +1,81 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import logging.handlers
+import os
+import queue
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from ai.gateway import ModelGateway
 from ai.types import (
     GatewayRequest, GatewayResponse,
     SwipeRequest, SwipeResponse, SessionStatsResponse, MatchesResponse
 )
 from contextlib import asynccontextmanager
+from pydantic import BaseModel
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger("cinematch")
+
+
+def _setup_logging() -> tuple[logging.Handler, logging.handlers.QueueListener]:
+    """
+    Root logger -> QueueHandler; stdout'a yazma background thread'de (QueueListener).
+    Request handler'lar log I/O'sunda beklemez. Seviye: CINEMATCH_LOG_LEVEL (default INFO).
+    Import'ta değil lifespan'de çağrılır; main'i import eden root logger'ı devralmaz.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("[%(name)s] %(levelname)s %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("CINEMATCH_LOG_LEVEL", "INFO").upper())
+    listener.start()
+    return queue_handler, listener
+
+
+# Model gateway (includes feedback learner): import'ta değil lifespan'de, worker başına bir kez
+gateway: Optional[ModelGateway] = None
+
 
 @asynccontextmanager
 async def lifespan(app):
-    # Seed ChromaDB on startup if empty
+    global gateway
+    queue_handler, log_listener = _setup_logging()
+    # asyncio.to_thread default executor'ı kullanır; default boyut (min(32, cpu+4))
+    # Groq / ChromaDB beklemesinde dolabiliyor. CINEMATCH_THREADPOOL_SIZE ile ayarlanır.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(
+            max_workers=int(os.getenv("CINEMATCH_THREADPOOL_SIZE", "64")),
+            thread_name_prefix="cinematch"
+        )
+    )
+    # Seed ChromaDB on startup if empty (gunicorn on_starting zaten seed etti; burada sadece
+    # doğrudan uvicorn ile çalışırken iş yapar). Event loop'u tutmasın
     from startup import seed_if_empty
-    seed_if_empty()
+    await asyncio.to_thread(seed_if_empty)
+    gateway = ModelGateway()
+    warmup_s = await asyncio.to_thread(gateway.warm_up)
+    logger.info("Gateway warm-up done in %.2fs", warmup_s)
     yield
+    from ai.http_pool import aclose_http_clients
+    await aclose_http_clients()
+    # Önce handler'ı çıkar: stop()'tan sonra gelen kayıtlar dinlenmeyen kuyrukta kalmasın
+    logging.getLogger().removeHandler(queue_handler)
+    log_listener.stop()
 
 
-app = FastAPI(title="CineMatch Recommendation API", lifespan=lifespan)
+app = FastAPI(
+    title="CineMatch Recommendation API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # CORS - get request from frontend
 app.add_middleware(
@@ -28,11 +85,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize model gateway once (includes feedback learner)
-gateway = ModelGateway()
+def _model_response(model: BaseModel) -> Response:
+    """
+    Büyük payload'lar (matches, stats) için: JSON'u pydantic-core doğrudan üretir.
+    FastAPI'nin response_model re-validation + jsonable_encoder adımı atlanır;
+    response_model decorator'da OpenAPI şeması için kalır.
+    """
+    return Response(content=model.model_dump_json(), media_type="application/json")
+
+
+# Endpoint'ler async; gateway çağrıları bloklayıcı (model, ChromaDB, Groq, lazy init)
+# olduğu için asyncio.to_thread ile event loop dışında çalışır
 
-@app.post('/recommendations', response_model=GatewayResponse, response_model_exclude_none=False)
-def recommend_movies(request: GatewayRequest):
+@app.post('/recommendations', response_model=GatewayResponse)
+async def recommend_movies(request: GatewayRequest):
     """
     Grup için film önerisi al.
 
@@ -54,17 +120,18 @@ def recommend_movies(request: GatewayRequest):
     """
     # Eğer session_id varsa feedback-aware recommendation yap
     if request.session_id:
-        # Debug logging
-        seen_films = gateway.get_seen_films(request.session_id)
-        stats = gateway.get_session_stats(request.session_id)
-        print(f"\n[CineMatch] Feedback-aware recommendation request:")
-        print(f"  - session_id: {request.session_id}")
-        print(f"  - round: {request.round}")
-        print(f"  - seen_films count: {len(seen_films)}")
-        print(f"  - seen_films: {seen_films[:10]}..." if len(seen_films) > 10 else f"  - seen_films: {seen_films}")
-        print(f"  - user stats: {stats}")
-
-        return gateway.recommend_with_feedback(
+        # Debug logging (stats sadece DEBUG açıkken toplanır)
+        if logger.isEnabledFor(logging.DEBUG):
+            stats, seen_films = await asyncio.to_thread(gateway.get_session_snapshot, request.session_id)
+            logger.debug(
+                "Feedback-aware recommendation request: session_id=%s round=%s "
+                "seen_films count=%d seen_films=%s%s user stats=%s",
+                request.session_id, request.round, len(seen_films),
+                seen_films[:10], "..." if len(seen_films) > 10 else "", stats
+            )
+
+        return await asyncio.to_thread(
+            gateway.recommend_with_feedback,
             participants=request.participants,
             session_id=request.session_id,
             num_recommendations=request.num_recommendations,
@@ -72,20 +139,21 @@ def recommend_movies(request: GatewayRequest):
         )
 
     # Yoksa normal recommendation
-    return gateway.recommend(
+    return await asyncio.to_thread(
+        gateway.recommend,
         participants=request.participants,
         num_recommendations=request.num_recommendations
     )
 
 @app.get("/health")
-def health_check():
-    return {"status": "ok"}
+async def health_check():
+    return {"status": "ok", "query_embedding_cache": gateway.embedding_query_cache_info()}
 
 
 # ============ Swipe Feedback Endpoints ============
 
 @app.post('/swipe', response_model=SwipeResponse)
-def record_swipe(request: SwipeRequest):
+async def record_swipe(request: SwipeRequest):
     """
     Kullanıcı swipe'ını kaydet (online learning için).
 
@@ -97,16 +165,23 @@ def record_swipe(request: SwipeRequest):
         "action": "like"  // "like", "dislike", "skip"
     }
     """
-    print(f"[CineMatch] Recording swipe: session={request.session_id}, user={request.user_name}, movie={request.movie_id}, action={request.action.value}")
+    logger.debug(
+        "Recording swipe: session=%s, user=%s, movie=%s, action=%s",
+        request.session_id, request.user_name, request.movie_id, request.action.value
+    )
 
-    result = gateway.record_swipe(
+    result = await asyncio.to_thread(
+        gateway.record_swipe,
         session_id=request.session_id,
         user_name=request.user_name,
         movie_id=request.movie_id,
         action=request.action.value
     )
 
-    print(f"[CineMatch] Swipe recorded: total_swipes={result['total_swipes']}, feedback_ready={result.get('feedback_ready', False)}")
+    logger.debug(
+        "Swipe recorded: total_swipes=%s, feedback_ready=%s",
+        result["total_swipes"], result.get("feedback_ready", False)
+    )
 
     return SwipeResponse(
         recorded=result["recorded"],
@@ -116,7 +191,7 @@ def record_swipe(request: SwipeRequest):
 
 
 @app.get('/session/{session_id}/stats', response_model=SessionStatsResponse)
-def get_session_stats(session_id: str):
+async def get_session_stats(session_id: str):
     """
     Session swipe istatistiklerini al.
 
@@ -130,25 +205,24 @@ def get_session_stats(session_id: str):
         "seen_films": [123, 456, 789, ...]
     }
     """
-    stats = gateway.get_session_stats(session_id)
-    seen_films = gateway.get_seen_films(session_id)
+    stats, seen_films = await asyncio.to_thread(gateway.get_session_snapshot, session_id)
 
-    return SessionStatsResponse(
+    return _model_response(SessionStatsResponse(
         session_id=session_id,
         stats=stats,
         seen_films=seen_films
-    )
+    ))
 
 
 @app.delete('/session/{session_id}')
-def clear_session(session_id: str):
+async def clear_session(session_id: str):
     """Session swipe verilerini temizle"""
-    cleared = gateway.clear_session(session_id)
+    cleared = await asyncio.to_thread(gateway.clear_session, session_id)
     return {"cleared": cleared, "session_id": session_id}
 
 
 @app.get('/session/{session_id}/matches', response_model=MatchesResponse)
-def get_session_matches(session_id: str):
+async def get_session_matches(session_id: str):
     """
     Calculate and return matches for a session.
 
@@ -169,12 +243,11 @@ def get_session_matches(session_id: str):
     }
     """
     # Get match calculations
-    matches = gateway.calculate_matches(session_id)
+    matches = await asyncio.to_thread(gateway.calculate_matches, session_id)
 
     # Get user count and seen films
-    stats = gateway.get_session_stats(session_id)
+    stats, seen_films = await asyncio.to_thread(gateway.get_session_snapshot, session_id)
     user_count = len(stats)
-    seen_films = gateway.get_seen_films(session_id)
     seen_count = len(seen_films)
 
     # Calculate no match count
@@ -182,16 +255,16 @@ def get_session_matches(session_id: str):
     majority_count = len(matches.get("majority", []))
     no_match_count = seen_count - perfect_count - majority_count
 
-    return MatchesResponse(
+    return _model_response(MatchesResponse(
         session_id=session_id,
         user_count=user_count,
         matches=matches,
         no_match_count=max(0, no_match_count)
-    )
+    ))
 
 
 @app.get('/evaluate')
-def run_evaluation():
+async def run_evaluation():
     """
     Run the evaluation pipeline and return metrics.
 
@@ -205,6 +278,8 @@ def run_evaluation():
     """
     from ml.evaluation import RecommendationEvaluator
 
-    evaluator = RecommendationEvaluator(gateway.fair_recommender)
-    results = evaluator.run_full_evaluation(verbose=True)
-    return results
\ No newline at end of file
+    def _evaluate():
+        evaluator = RecommendationEvaluator(gateway.fair_recommender)
+        return evaluator.run_full_evaluation(verbose=True)
+
+    return await asyncio.to_thread(_evaluate)
\ No newline at end of file
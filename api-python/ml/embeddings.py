@@ -1,12 +1,252 @@
+import functools
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from db.vector_store import  MovieVectorStore
 
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Micro-batcher: farklı request thread'lerinden gelen tek query'leri
+    kısa bir pencerede (max_wait) toplayıp tek encode çağrısına verir."""
+
+    def __init__(self, encode_fn: Callable[[list[str]], list[list[float]]], max_batch: int = 32, max_wait: float = 0.005):
+        self._encode = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def submit(self, text: str) -> list[float]:
+        """Embed one text; blocks until its batch is encoded"""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    worker.start()
+                    self._worker = worker
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                embeddings = self._encode([text for text, _ in batch])
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# CINEMATCH_EMBEDDING_BACKEND -> (sentence-transformers backend, model file)
+# all-MiniLM-L6-v2 repo'sunda ONNX export ve INT8 (dynamic, AVX512-VNNI) versiyonu hazır geliyor
+_BACKENDS = {
+    "torch": ("torch", None),
+    "onnx": ("onnx", "onnx/model.onnx"),
+    "onnx-int8": ("onnx", "onnx/model_qint8_avx512_vnni.onnx"),
+}
+
+
+def _backend_choice() -> str:
+    choice = os.getenv("CINEMATCH_EMBEDDING_BACKEND", "torch").lower()
+    return choice if choice in _BACKENDS else "torch"
+
+
+class EmbeddingCache:
+    """Disk cache: hash(model + text) -> float32 embedding (sqlite).
+    Restart'ta / reseed'de değişmeyen filmler yeniden encode edilmez."""
+
+    _CHUNK = 500  # sqlite IN (...) parametre limiti altında kal
+
+    def __init__(self, path: str = "db/emb_cache.db"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, vec BLOB)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_id: str, text: str) -> str:
+        return hashlib.blake2s(f"{model_id}\n{text}".encode(), digest_size=16).hexdigest()
+
+    def get_many(self, hashes: list[str]) -> dict[str, np.ndarray]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), self._CHUNK):
+                chunk = hashes[i:i + self._CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM cache WHERE hash IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((h, np.frombuffer(vec, dtype=np.float32)) for h, vec in rows)
+        return found
+
+    def put_many(self, items: list[tuple[str, np.ndarray]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (hash, vec) VALUES (?, ?)",
+                [(h, np.asarray(vec, dtype=np.float32).tobytes()) for h, vec in items]
+            )
+            self._conn.commit()
+
+
+def _configure_torch_threads() -> None:
+    """TORCH_THREADS / TORCH_INTEROP_THREADS verilmişse torch thread pool'larını ayarla.
+    Verilmezse torch default'u (fiziksel core sayısı) kalır; multi-worker deploy'da
+    worker başına core ayırmak için kullanılır."""
+    threads = os.getenv("TORCH_THREADS")
+    if not threads:
+        return
+    import torch
+    torch.set_num_threads(int(threads))
+    try:
+        torch.set_num_interop_threads(int(os.getenv("TORCH_INTEROP_THREADS", "2")))
+    except RuntimeError:
+        pass  # interop pool zaten başlamış, sadece bir kez ayarlanabiliyor
+
+
+# Half precision'a geçmeden önce FP32 ile karşılaştırılan sabit metinler (mood query'leri + film text'i)
+_DRIFT_GOLDEN_SET = (
+    "funny lighthearted comedy",
+    "romantic emotional love story",
+    "scary horror suspense thriller",
+    "Inception. Action, Science Fiction, Adventure. A thief who steals corporate secrets "
+    "through the use of dream-sharing technology is given the inverse task of planting an idea.",
+)
+# Golden set'te FP32'ye göre kabul edilen minimum cosine (en kötü metin)
+_MIN_DRIFT_COSINE = {"fp16": 0.999, "bf16": 0.995}
+
+
+def _to_half_precision(model: SentenceTransformer) -> SentenceTransformer:
+    """
+    GPU varsa FP16 (MatMul bandwidth yarıya iner, cosine drift ~1e-4).
+    CPU'da BF16 sadece CINEMATCH_EMBEDDING_DTYPE=bf16 ile (AMX / AVX512-BF16 olan host'lar);
+    CINEMATCH_EMBEDDING_DTYPE=fp32 her durumda FP32'de bırakır.
+    Her iki durumda da golden set drift check'inden geçemezse FP32'de kalır.
+    """
+    dtype = os.getenv("CINEMATCH_EMBEDDING_DTYPE", "auto").lower()
+    if dtype == "fp32":
+        return model
+    import torch
+    if torch.cuda.is_available() and dtype in ("auto", "fp16"):
+        return _checked_half_precision(model.to("cuda"), torch.float16, "fp16")
+    if dtype == "bf16":
+        model = _checked_half_precision(model, torch.bfloat16, "bf16")
+        if next(model.parameters()).dtype == torch.bfloat16:
+            torch.set_float32_matmul_precision("medium")
+        return model
+    return model
+
+
+def _checked_half_precision(model: SentenceTransformer, torch_dtype, name: str) -> SentenceTransformer:
+    """Modeli torch_dtype'a çevir; golden set embedding'leri FP32'den sapıyorsa FP32'ye geri al"""
+    golden = list(_DRIFT_GOLDEN_SET)
+    reference = model.encode(golden, normalize_embeddings=True, show_progress_bar=False)
+    model = model.to(torch_dtype)
+    half = model.encode(golden, normalize_embeddings=True, show_progress_bar=False)
+    min_cosine = float((np.asarray(reference, dtype=np.float32) * np.asarray(half, dtype=np.float32)).sum(axis=1).min())
+    if min_cosine < _MIN_DRIFT_COSINE[name]:
+        logger.warning(
+            "%s embeddings drift from FP32 (min cosine %.5f < %.3f), staying on FP32",
+            name, min_cosine, _MIN_DRIFT_COSINE[name]
+        )
+        return model.float()
+    logger.info("%s embeddings match FP32 on the golden set (min cosine %.5f)", name, min_cosine)
+    return model
+
+
+def _maybe_compile(model: SentenceTransformer) -> SentenceTransformer:
+    """
+    CINEMATCH_TORCH_COMPILE=1 ise transformer'ı torch.compile ile derle (torch >= 2.1).
+    Attention zaten transformers'ın SDPA (fused / flash) kernel'ı ile çalışıyor,
+    compile bunun üstüne kernel-launch overhead'ini azaltır. Query uzunlukları
+    değiştiği için dynamic=True; JIT maliyeti _load_model'daki warm-up'ta ödenir.
+    """
+    if os.getenv("CINEMATCH_TORCH_COMPILE", "0") != "1":
+        return model
+    import torch
+    if not hasattr(torch, "compile"):
+        return model
+    mode = "reduce-overhead" if torch.cuda.is_available() else "default"
+    try:
+        model[0].auto_model = torch.compile(model[0].auto_model, mode=mode, dynamic=True, fullgraph=False)
+    except Exception as e:
+        logger.warning("torch.compile unavailable (%s), using eager model", e)
+    return model
+
+
+@functools.lru_cache(maxsize=None)
+def _load_model(choice: str = "torch") -> SentenceTransformer:
+    """
+    Embedding modelini yükle (process başına backend başına bir kez; tüm
+    EmbeddingEngine'ler aynı modeli paylaşır). Default PyTorch; ONNX Runtime için
+    CINEMATCH_EMBEDDING_BACKEND=onnx | onnx-int8 (sentence-transformers[onnx] gerekir).
+
+    Not: ChromaDB'deki vektörler aynı backend ile üretilmeli; backend değişirse
+    (özellikle int8) vector store yeniden seed edilmeli.
+    """
+    _configure_torch_threads()
+    backend, file_name = _BACKENDS[choice]
+    if backend == "torch":
+        model = _maybe_compile(_to_half_precision(SentenceTransformer(MODEL_NAME)))
+        # Warm-up: ilk kullanıcı isteği lazy init / JIT gecikmesini yemesin
+        model.encode(["warm-up"], show_progress_bar=False)
+        return model
+    try:
+        return SentenceTransformer(MODEL_NAME, backend=backend, model_kwargs={"file_name": file_name})
+    except (ImportError, ValueError, TypeError) as e:
+        logger.warning("ONNX backend unavailable (%s), falling back to PyTorch", e)
+        return SentenceTransformer(MODEL_NAME)
+
+
 class EmbeddingEngine:
+    SEED_CHUNK_SIZE = 2048  # embed_all_movies: bir seferde encode + insert edilen film sayısı
+
     def __init__(self):
-        # Model yükle (ilk seferde indirir ~90MB)
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Model yükle (ilk seferde indirir ~90MB; process içinde paylaşılır)
+        self.model = _load_model(_backend_choice())
         self.movie_embeddings= {} #movie_id: embedding vector
         self.vector_store = MovieVectorStore()
+        # Cache key'ine model + backend girer (farklı backend'in vektörleri karışmasın)
+        self.model_id = f"{MODEL_NAME}:{_backend_choice()}"
+        self.embedding_cache = EmbeddingCache()
+        # Eşzamanlı request'lerin query'leri tek forward pass'te encode edilir
+        self._batcher = EmbeddingBatcher(
+            lambda texts: self.model.encode(texts, batch_size=32, normalize_embeddings=True).tolist()
+        )
+        # Mood query'leri küçük bir kelime havuzundan geliyor, aynı string tekrar encode edilmesin.
+        # Instance başına (lru_cache method'da self'i global cache'te tutardı); tuple = immutable
+        self._encode_single = functools.lru_cache(maxsize=4096)(
+            lambda text: tuple(self._batcher.submit(text))
+        )
     
     def embed_movie(self, movie: dict):
         # make one big text from movie details
@@ -16,37 +256,87 @@ class EmbeddingEngine:
     
     def _create_film_text(self, movie: dict) -> str:
         """Film bilgilerini tek string'e çevir"""
-        title = movie.get("title", "")
-        overview = movie.get("overview", "")
-        genres = ", ".join(movie.get("genres", []))
-                      
-        return f"{title}. {genres}. {overview}"
+        get = movie.get
+        return f"{get('title', '')}. {', '.join(get('genres', []))}. {get('overview', '')}"
     
     def embed_all_movies(self,movies: list[dict]) -> None:
-        #Remove duplicates by ID
-        seen_ids = set()
-        unique_movies= []
-
-        for movie in movies:
-            if movie["id"] not in seen_ids:
-                unique_movies.append(movie)
-                seen_ids.add(movie["id"])
-            
+        #Remove duplicates by ID (tek dict build; reversed = ilk görülen kayıt kazanır)
+        unique_movies = list({m["id"]: m for m in reversed(movies)}.values())[::-1]
+        # Film text'leri film başına bir kez hazırla
+        # (movie dict'lerine yazılmaz: katalog dict'leri paylaşılıyor olabilir)
+        film_texts = [self._create_film_text(m) for m in unique_movies]
+
         print(f"Removed {len(movies) - len(unique_movies)} duplicates")
 
         #Embed all movies and register to chromadb
-        # Film text'lerini hazırla
-        texts = [self._create_film_text(m) for m in unique_movies]
-       #create embeddings for all moviess
-        embeddings = self.model.encode(texts, show_progress_bar=True)
-        # Store embeddings in vector store
-      
-        self.vector_store.add_movie_embedding(unique_movies, embeddings.tolist()) 
+        # Chunk'lar halinde: peak bellek chunk boyutuyla sınırlı, float32 array
+        # direkt vector store'a gider (.tolist() ile Python float listeleri yok).
+        # Double-buffering: chunk N ChromaDB'ye yazılırken chunk N+1 encode edilir
+        pending: queue.Queue = queue.Queue(maxsize=2)
+        upsert_errors: list[BaseException] = []
+
+        def _upsert_worker():
+            while (item := pending.get()) is not None:
+                if upsert_errors:
+                    continue  # hata sonrası kalanları boşalt, producer bloklanmasın
+                try:
+                    self.vector_store.add_movie_embedding(*item)
+                except BaseException as e:
+                    upsert_errors.append(e)
+
+        upsert_thread = threading.Thread(target=_upsert_worker, name="chroma-upsert", daemon=True)
+        upsert_thread.start()
+        try:
+            for i in range(0, len(unique_movies), self.SEED_CHUNK_SIZE):
+                if upsert_errors:
+                    break
+                chunk = unique_movies[i:i + self.SEED_CHUNK_SIZE]
+                #create embeddings (sadece cache'te olmayanlar encode edilir)
+                embeddings = self._encode_cached(film_texts[i:i + self.SEED_CHUNK_SIZE])
+                # Store embeddings in vector store (upsert thread'inde)
+                pending.put((chunk, embeddings))
+        finally:
+            pending.put(None)
+            upsert_thread.join()
+        if upsert_errors:
+            raise upsert_errors[0]
         print(f"Done! {self.vector_store.get_count()} movies in vector store")
     
+    def _encode_cached(self, texts: list[str]) -> np.ndarray:
+        """model.encode(texts) ama disk cache'teki metinler atlanır; sıra korunur"""
+        hashes = [EmbeddingCache.key(self.model_id, t) for t in texts]
+        cached = self.embedding_cache.get_many(hashes)
+        missing = [i for i, h in enumerate(hashes) if h not in cached]
+        logger.info("Embedding cache: %d hits, %d to encode", len(texts) - len(missing), len(missing))
+
+        embeddings = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        if missing:
+            # Unit-norm kaydedilir: vector store inner product ile arar (cosine'in norm hesabı yok).
+            # Smart batching: encode() metinleri uzunluğa göre sıralayıp batch'ler ve
+            # sonucu orijinal sıraya geri koyar, padding israfı zaten yok
+            new = self.model.encode([texts[i] for i in missing], show_progress_bar=True, normalize_embeddings=True)
+            embeddings[missing] = new
+            self.embedding_cache.put_many([(hashes[i], new[j]) for j, i in enumerate(missing)])
+        for i, h in enumerate(hashes):
+            if h in cached:
+                embeddings[i] = cached[h]
+        return embeddings
+
     def embed_query (self,query:str) -> list[float]:
         """ Embed user pereference query/ mood into vector"""
-        return self.model.encode([query])[0].tolist()
+        return list(self._encode_single(query))
+
+    def query_cache_info(self) -> dict:
+        """embed_query LRU istatistikleri (/health için)"""
+        info = self._encode_single.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+
+    def embed_batch(self, queries: list[str]) -> list[list[float]]:
+        """Embed several queries in one forward pass (group mode: one per participant)"""
+        if not queries:
+            return []
+        return self.model.encode(queries, normalize_embeddings=True).tolist()
+
     def search_similar_movies(self, query: str, top_k: int=5) -> list[dict]:
         """ Search similar movies from vector store based on user query"""
         query_embedding= self.embed_query(query)
@@ -12,14 +12,82 @@ Kullanım:
     results = evaluator.run_full_evaluation()
 """
 
+import copy
+import hashlib
+import os
+import pickle
+import threading
 import numpy as np
+from collections import OrderedDict
 from typing import List, Dict, Optional, TYPE_CHECKING
-from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from statistics import fmean, pstdev
 import time
 
 if TYPE_CHECKING:
     from ml.group_fairness import FairGroupRecommender
 
+try:  # Opsiyonel: numba kuruluysa küçük reduction'lar native loop olarak derlenir
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _entropy_np(counts: np.ndarray) -> float:
+    """Shannon entropy (bits) of positive counts"""
+    probs = counts / counts.sum()
+    return float(-(probs @ np.log2(probs)))
+
+
+def _fairness_reduce_np(scores: np.ndarray):
+    """(users x recs) NaN'li skor matrisi -> (skoru olan rec'lerin min'i, kullanıcı ortalamaları; skorsuz = 0)"""
+    present = ~np.isnan(scores)
+    min_scores = np.nanmin(scores[:, present.any(axis=0)], axis=0)
+    counts = present.sum(axis=1)
+    user_means = np.where(counts > 0, np.nansum(scores, axis=1) / np.maximum(counts, 1), 0.0)
+    return min_scores, user_means
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _entropy(counts):
+        total = counts.sum()
+        e = 0.0
+        for v in counts:
+            p = v / total
+            e -= p * np.log2(p)
+        return e
+
+    @njit(cache=True)
+    def _fairness_reduce(scores):
+        n_users, n_recs = scores.shape
+        min_scores = np.empty(n_recs)
+        n_min = 0
+        for j in range(n_recs):
+            m = np.inf
+            for i in range(n_users):
+                v = scores[i, j]
+                if v == v and v < m:  # v == v: NaN değil
+                    m = v
+            if m != np.inf:
+                min_scores[n_min] = m
+                n_min += 1
+        user_means = np.zeros(n_users)
+        for i in range(n_users):
+            total = 0.0
+            count = 0
+            for j in range(n_recs):
+                v = scores[i, j]
+                if v == v:
+                    total += v
+                    count += 1
+            if count > 0:
+                user_means[i] = total / count
+        return min_scores[:n_min], user_means
+else:
+    _entropy = _entropy_np
+    _fairness_reduce = _fairness_reduce_np
+
 
 class RecommendationEvaluator:
     """
@@ -48,6 +116,15 @@ class RecommendationEvaluator:
         'cozy': ['Comedy', 'Romance', 'Family', 'Animation'],
     }
 
+    # (model_id, collection imzası, mood, top_k) -> recs; tüm evaluator instance'ları
+    # paylaşır, LRU ile sınırlı
+    _mood_probe_cache: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+    _mood_probe_lock = threading.Lock()
+    MOOD_PROBE_CACHE_SIZE = 256
+
+    EVAL_WORKERS = 4  # run_full_evaluation'daki paralel test fazları
+    METADATA_PAGE_SIZE = 1000  # ChromaDB'den metadata çekerken sayfa boyutu
+
     def __init__(
         self,
         fair_recommender: "FairGroupRecommender",
@@ -62,48 +139,232 @@ class RecommendationEvaluator:
         self.recommender = fair_recommender
         self.metadata = film_metadata or {}
         self._load_metadata_from_chroma()
+        # Lazy genre tabloları (_build_genre_tables)
+        self._genre_vocab: List[str] = []
+        self._genre_index: Dict[str, int] = {}
+        self._genre_idx: Dict[int, np.ndarray] = {}
+        self._genre_masks: Optional[Dict[int, int]] = None
+        if njit is not None:
+            # JIT warm-up (cache=True ile sonraki process'lerde diskten yüklenir)
+            _entropy(np.ones(2))
+            _fairness_reduce(np.ones((2, 2)))
+        # Aynı test grubu birden fazla fazda (diversity, fairness, feedback round 1) öneriliyor.
+        # Key başına Future: paralel fazlar aynı grubu isterse tek recommend_fair beklenir
+        self._rec_cache: Dict[tuple, Future] = {}
+        self._rec_lock = threading.Lock()
 
     def _load_metadata_from_chroma(self):
         """ChromaDB'den film metadata'sını yükle"""
         if self.metadata:
             return  # Zaten yüklü
 
-        try:
-            # Get all films from ChromaDB
-            collection = self.recommender.embedding_engine.vector_store.collection
-            results = collection.get(
-                include=["metadatas"],
-                limit=10000  # Tüm filmleri al
-            )
+        collection = self.recommender.embedding_engine.vector_store.collection
+        cache_path = self._metadata_cache_path(collection)
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                self.metadata = pickle.load(f)
+            print(f"[Evaluation] Loaded metadata for {len(self.metadata)} films from {cache_path}")
+            return
 
-            for i, doc_id in enumerate(results['ids']):
-                try:
-                    movie_id = int(doc_id)
-                    meta = results['metadatas'][i] if results['metadatas'] else {}
-
-                    # Parse genres from string if needed
-                    genres = meta.get('genres', [])
-                    if isinstance(genres, str):
-                        genres = [g.strip() for g in genres.split(',')]
-
-                    self.metadata[movie_id] = {
-                        'title': meta.get('title', f'Movie {movie_id}'),
-                        'genres': genres,
-                        'year': meta.get('year', 2000),
-                        'vote_average': meta.get('vote_average', 0),
-                    }
-                except (ValueError, TypeError):
-                    continue
+        try:
+            # Get all films from ChromaDB, sayfa sayfa (bellek sayfa boyutuyla sınırlı,
+            # katalog 10k'yı geçerse sessizce kesilmez)
+            offset = 0
+            while True:
+                page = collection.get(
+                    include=["metadatas"],
+                    limit=self.METADATA_PAGE_SIZE,
+                    offset=offset
+                )
+                ids = page['ids']
+                if not ids:
+                    break
+                metadatas = page['metadatas'] or [{}] * len(ids)
+
+                for doc_id, meta in zip(ids, metadatas):
+                    try:
+                        movie_id = int(doc_id)
+                        meta = meta or {}
+
+                        # Parse genres from string if needed
+                        genres = meta.get('genres')
+                        if isinstance(genres, str):
+                            genres = [g.strip() for g in genres.split(',')]
+                        elif genres is None:
+                            genres = []
+
+                        self.metadata[movie_id] = {
+                            'title': meta.get('title', f'Movie {movie_id}'),
+                            'genres': genres,
+                            'year': self._parse_year(meta.get('year', 2000)),
+                            'vote_average': meta.get('vote_average', 0),
+                        }
+                    except (ValueError, TypeError):
+                        continue
+
+                if len(ids) < self.METADATA_PAGE_SIZE:
+                    break
+                offset += self.METADATA_PAGE_SIZE
 
             print(f"[Evaluation] Loaded metadata for {len(self.metadata)} films")
         except Exception as e:
             print(f"[Evaluation] Warning: Could not load metadata from ChromaDB: {e}")
+            return
+
+        if cache_path and self.metadata:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self.metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+
+    @staticmethod
+    def _collection_signature(collection) -> Optional[str]:
+        """Collection imzası: satır sayısı + ilk id'ler (reseed'de değişir); okunamazsa None"""
+        try:
+            count = collection.count()
+            first_ids = collection.get(limit=100, include=[])["ids"]
+        except Exception:
+            return None
+        return hashlib.sha1(f"{count}:{','.join(first_ids)}".encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _metadata_cache_path(collection) -> Optional[str]:
+        """
+        CINEMATCH_EVAL_METADATA_CACHE=1 ise metadata pickle'ının yolu (dev workflow'ları için).
+        Dosya adı collection imzası; reseed'de eski dosya kullanılmaz.
+        """
+        if os.getenv("CINEMATCH_EVAL_METADATA_CACHE", "0") != "1":
+            return None
+        signature = RecommendationEvaluator._collection_signature(collection)
+        if signature is None:
+            return None
+        return os.path.join("db", f"eval_metadata-{signature}.pkl")
+
+    def _mood_probe_recs(self, moods: List[str], top_k: int) -> List[List[Dict]]:
+        """
+        Genre alignment probe önerileri, process genelinde cache'li: key = (embedding
+        model_id (model + backend), collection imzası, mood, top_k). Evaluator'ı tekrar
+        çalıştırmak (notebook, /evaluate) değişmeyen model + katalogda yeniden embed +
+        search yapmaz. Cache'te olmayan mood'lar tek embedding batch + tek vector store sorgusunda.
+        """
+        engine = self.recommender.embedding_engine
+        collection_sig = self._collection_signature(engine.vector_store.collection)
+        if collection_sig is None:
+            # İmza yoksa cache'e güvenilmez: doğrudan hesapla
+            test_users = [{'name': 'test_user', 'moods': [mood], 'note': ''} for mood in moods]
+            return self.recommender.recommend_solo_batch(test_users, n_results=top_k)
+
+        signature = (engine.model_id, collection_sig)
+        cache = RecommendationEvaluator._mood_probe_cache
+        with RecommendationEvaluator._mood_probe_lock:
+            found = {}
+            for m in moods:
+                key = (signature, m, top_k)
+                if key in cache:
+                    cache.move_to_end(key)
+                    found[m] = cache[key]
+        missing = [m for m in dict.fromkeys(moods) if m not in found]
+
+        if missing:
+            test_users = [{'name': 'test_user', 'moods': [mood], 'note': ''} for mood in missing]
+            fresh = self.recommender.recommend_solo_batch(test_users, n_results=top_k)
+            with RecommendationEvaluator._mood_probe_lock:
+                for mood, recs in zip(missing, fresh):
+                    found[mood] = recs
+                    cache[(signature, mood, top_k)] = recs
+                    cache.move_to_end((signature, mood, top_k))
+                while len(cache) > RecommendationEvaluator.MOOD_PROBE_CACHE_SIZE:
+                    cache.popitem(last=False)
+
+        return [copy.deepcopy(found[m]) for m in moods]
+
+    @classmethod
+    def invalidate_cache(cls) -> None:
+        """Process genelindeki mood probe cache'ini temizle"""
+        with cls._mood_probe_lock:
+            cls._mood_probe_cache.clear()
+
+    def _recommend(self, participants: List[Dict], n_results: int) -> List[Dict]:
+        """recommend_fair, aynı (participants, n_results) için memoize edilmiş (kopya döner)"""
+        key = (
+            tuple(
+                (p['name'], tuple(p.get('moods', [])), p.get('note', ''))
+                for p in participants
+            ),
+            n_results
+        )
+        with self._rec_lock:
+            future = self._rec_cache.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._rec_cache[key] = Future()
+
+        if is_owner:
+            try:
+                future.set_result(self.recommender.recommend_fair(participants, n_results=n_results))
+            except BaseException as e:
+                # Hata cache'lenmez: bekleyenler hatayı alır, sonraki çağrı yeniden dener
+                with self._rec_lock:
+                    self._rec_cache.pop(key, None)
+                future.set_exception(e)
+                raise
+        return copy.deepcopy(future.result())
+
+    @staticmethod
+    def _parse_year(value) -> int:
+        """Year -> int, geçersizse 0 (metadata yüklerken bir kez; try/except yok)"""
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return int(value) if value == value else 0  # NaN
+        if isinstance(value, str):
+            value = value.strip()
+            return int(value) if value.isdigit() else 0
+        return 0
+
+    def _build_genre_tables(self) -> None:
+        """
+        Genre vocabulary metadata'dan, bir kez: movie_id -> bitmask (alignment) ve
+        movie_id -> genre index array (diversity sayımı). Local'de kurulup en son
+        atanır (paralel eval thread'leri yarım tablo görmesin).
+        """
+        vocab = sorted({g for film in self.metadata.values() for g in film.get('genres', [])})
+        index = {name: i for i, name in enumerate(vocab)}
+        genre_idx: Dict[int, np.ndarray] = {}
+        masks: Dict[int, int] = {}
+        for movie_id, film in self.metadata.items():
+            indices = [index[g] for g in film.get('genres', [])]
+            genre_idx[movie_id] = np.array(indices, dtype=np.intp)
+            mask = 0
+            for i in indices:
+                mask |= 1 << i
+            masks[movie_id] = mask
+
+        self._genre_vocab = vocab
+        self._genre_index = index
+        self._genre_idx = genre_idx
+        self._genre_masks = masks
+
+    def _get_genre_masks(self) -> Dict[int, int]:
+        """movie_id -> genre bitmask"""
+        if self._genre_masks is None:
+            self._build_genre_tables()
+        return self._genre_masks
+
+    def _genre_mask(self, genres: List[str]) -> int:
+        """Genre listesi -> bitmask; vocabulary'de olmayan genre'ler atlanır"""
+        index = self._genre_index
+        mask = 0
+        for g in genres:
+            if g in index:
+                mask |= 1 << index[g]
+        return mask
 
     def evaluate_consistency(
         self,
         test_participants: List[Dict],
         n_trials: int = 5,
-        top_k: int = 10
+        top_k: int = 10,
+        early_stop_trials: Optional[int] = 2
     ) -> Dict:
         """
         Aynı input → Aynı output mu?
@@ -115,47 +376,69 @@ class RecommendationEvaluator:
             test_participants: Test için kullanıcı listesi
             n_trials: Kaç kez tekrarlanacak
             top_k: İlk kaç öneri karşılaştırılacak
+            early_stop_trials: İlk bu kadar trial birebir aynıysa kalan trial'lar atlanır
+                               (deterministik happy path); None = hep n_trials
 
         Returns:
             {
                 'overlap_ratio': float (0-1),
                 'unique_results': int,
+                'n_trials_actual': int,
                 'is_consistent': bool
             }
         """
         all_results = []
+        # Embedding deterministik: query'ler bir kez embed edilir, her trial sadece
+        # vector search + fairness ranking'i tekrarlar
+        embeddings = self.recommender.embed_participants(test_participants)
 
         for trial in range(n_trials):
             results = self.recommender.recommend_fair(
                 test_participants,
-                n_results=top_k
+                n_results=top_k,
+                participant_embeddings=embeddings
             )
-            movie_ids = set([r['movie_id'] for r in results[:top_k]])
+            movie_ids = {r['movie_id'] for r in results[:top_k]}
             all_results.append(movie_ids)
 
-        # Pairwise Jaccard similarity
-        overlaps = []
-        for i in range(len(all_results)):
-            for j in range(i + 1, len(all_results)):
-                intersection = len(all_results[i] & all_results[j])
-                union = len(all_results[i] | all_results[j])
-                jaccard = intersection / union if union > 0 else 1.0
-                overlaps.append(jaccard)
-
-        avg_overlap = np.mean(overlaps) if overlaps else 1.0
+            if (early_stop_trials and early_stop_trials >= 2
+                    and len(all_results) == early_stop_trials < n_trials
+                    and all(r == all_results[0] for r in all_results)):
+                break  # Kalan trial'lar yeni bilgi vermez
 
         # Unique movie count across all trials
-        all_movies = set()
-        for result_set in all_results:
-            all_movies.update(result_set)
+        all_movies = set().union(*all_results)
+
+        # Pairwise Jaccard similarity: trial x film indicator matrix A,
+        # intersection = A @ A.T, union = |i| + |j| - intersection
+        overlaps = self._pairwise_jaccard(all_results, sorted(all_movies))
+        avg_overlap = float(overlaps.mean()) if overlaps.size else 1.0
 
         return {
             'overlap_ratio': float(avg_overlap),
             'unique_results_across_trials': len(all_movies),
             'expected_if_consistent': top_k,
+            'n_trials_actual': len(all_results),
             'is_consistent': avg_overlap > 0.8
         }
 
+    @staticmethod
+    def _pairwise_jaccard(sets: List[set], vocab: List[int]) -> np.ndarray:
+        """i < j çiftleri için Jaccard benzerlikleri (boş union = 1.0)"""
+        if len(sets) < 2:
+            return np.empty(0)
+        col = {movie_id: j for j, movie_id in enumerate(vocab)}
+        A = np.zeros((len(sets), len(vocab)), dtype=np.int32)
+        for i, movie_ids in enumerate(sets):
+            A[i, [col[m] for m in movie_ids]] = 1
+
+        inter = A @ A.T
+        sizes = np.diag(inter)
+        rows, cols = np.triu_indices(len(sets), k=1)
+        intersection = inter[rows, cols]
+        union = sizes[rows] + sizes[cols] - intersection
+        return np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+
     def evaluate_genre_alignment(
         self,
         mood_to_expected_genres: Optional[Dict[str, List[str]]] = None,
@@ -180,35 +463,39 @@ class RecommendationEvaluator:
         mapping = mood_to_expected_genres or self.MOOD_GENRE_MAP
         results = {}
 
-        for mood, expected_genres in mapping.items():
-            test_participant = [{'name': 'test_user', 'moods': [mood], 'note': ''}]
+        try:
+            all_recs = self._mood_probe_recs(list(mapping), top_k)
+        except Exception as e:
+            print(f"[Evaluation] Error getting recommendations for mood probes: {e}")
+            return {mood: {'alignment': 0, 'error': str(e)} for mood in mapping}
 
-            try:
-                recs = self.recommender.recommend_fair(test_participant, n_results=top_k)
-            except Exception as e:
-                print(f"[Evaluation] Error getting recommendations for mood '{mood}': {e}")
-                results[mood] = {'alignment': 0, 'error': str(e)}
-                continue
+        # Inner loop'ta attribute lookup olmasın
+        genre_masks_get = self._get_genre_masks().get
+        meta = self.metadata
 
+        for (mood, expected_genres), recs in zip(mapping.items(), all_recs):
+            # Mood başına bir kez: beklenen genre'lerin bitmask'i
+            expected_mask = self._genre_mask(expected_genres)
             matches = 0
             total = 0
             matched_movies = []
 
             for rec in recs[:top_k]:
                 movie_id = rec['movie_id']
+                mask = genre_masks_get(movie_id)
 
-                if movie_id not in self.metadata:
+                if mask is None:
                     continue
 
-                film_genres = self.metadata[movie_id].get('genres', [])
                 total += 1
 
-                if any(g in film_genres for g in expected_genres):
+                if mask & expected_mask:
                     matches += 1
+                    film = meta[movie_id]
                     matched_movies.append({
                         'id': movie_id,
-                        'title': self.metadata[movie_id].get('title'),
-                        'genres': film_genres
+                        'title': film.get('title'),
+                        'genres': film.get('genres', [])
                     })
 
             alignment = matches / total if total > 0 else 0
@@ -249,45 +536,47 @@ class RecommendationEvaluator:
                 'is_diverse': bool
             }
         """
-        recs = self.recommender.recommend_fair(test_participants, n_results=top_k)
+        recs = self._recommend(test_participants, n_results=top_k)
 
-        all_genres = []
+        # Genre sayımı vocabulary üzerinde numpy array'de (film başına genre index'leri hazır)
+        self._get_genre_masks()
+        genre_counts = np.zeros(len(self._genre_vocab), dtype=np.int64)
         years = []
 
+        meta_get = self.metadata.get
+        genre_idx = self._genre_idx
+
         for rec in recs[:top_k]:
             movie_id = rec['movie_id']
+            film = meta_get(movie_id)
 
-            if movie_id not in self.metadata:
+            if film is None:
                 continue
 
-            film = self.metadata[movie_id]
-            genres = film.get('genres', [])
-            all_genres.extend(genres)
+            np.add.at(genre_counts, genre_idx[movie_id], 1)
 
+            # ChromaDB'den yüklenen metadata'da year zaten int; dışarıdan verilen için parse
             year = film.get('year')
+            if not isinstance(year, int):
+                year = self._parse_year(year)
             if year:
-                try:
-                    years.append(int(year))
-                except (ValueError, TypeError):
-                    pass
+                years.append(year)
 
         # Unique genres
-        unique_genres = list(set(all_genres))
+        present = np.flatnonzero(genre_counts)
+        unique_genres = [self._genre_vocab[i] for i in present]
         unique_count = len(unique_genres)
 
-        # Genre entropy (Shannon entropy)
-        if all_genres:
-            genre_counts = Counter(all_genres)
-            total = sum(genre_counts.values())
-            probs = [count / total for count in genre_counts.values()]
-            entropy = -sum(p * np.log2(p) for p in probs if p > 0)
-            max_entropy = np.log2(len(genre_counts)) if len(genre_counts) > 1 else 1
+        # Genre entropy (Shannon entropy), count > 0 olanlar üzerinde (log2 güvenli)
+        if unique_count:
+            entropy = float(_entropy(genre_counts[present].astype(np.float64)))
+            max_entropy = np.log2(unique_count) if unique_count > 1 else 1
             normalized_entropy = entropy / max_entropy if max_entropy > 0 else 0
         else:
             normalized_entropy = 0
 
         # Year spread
-        year_spread = float(np.std(years)) if len(years) > 1 else 0
+        year_spread = pstdev(years) if len(years) > 1 else 0
 
         return {
             'unique_genre_count': unique_count,
@@ -331,43 +620,36 @@ class RecommendationEvaluator:
                 'is_fair': True
             }
 
-        recs = self.recommender.recommend_fair(test_participants, n_results=top_k)
+        recs = self._recommend(test_participants, n_results=top_k)
 
-        min_scores = []
-        all_user_scores = {p['name']: [] for p in test_participants}
+        # (users x recs) skor matrisi; kullanıcının skoru yoksa NaN
+        names = list(dict.fromkeys(p['name'] for p in test_participants))
+        idx = {name: i for i, name in enumerate(names)}
+        top = recs[:top_k]
+        scores = np.full((len(names), len(top)), np.nan)
+        for j, rec in enumerate(top):
+            for user_name, score in rec.get('individual_scores', {}).items():
+                if user_name in idx:
+                    scores[idx[user_name], j] = score
 
-        for rec in recs[:top_k]:
-            individual = rec.get('individual_scores', {})
+        # Rec başına en mutsuz kullanıcının skoru + user averages (hiç skoru olmayan kullanıcı 0)
+        min_scores, user_means = _fairness_reduce(scores)
 
-            if individual:
-                min_scores.append(min(individual.values()))
+        # Find worst and best (eşitlikte eski stable sort ile aynı: ilk min, son max)
+        worst_i = int(np.argmin(user_means))
+        best_i = len(names) - 1 - int(np.argmax(user_means[::-1]))
 
-                for user_name, score in individual.items():
-                    if user_name in all_user_scores:
-                        all_user_scores[user_name].append(score)
-
-        # User averages
-        user_avg_scores = {
-            name: float(np.mean(scores)) if scores else 0
-            for name, scores in all_user_scores.items()
-        }
-
-        # Find worst and best
-        sorted_users = sorted(user_avg_scores.items(), key=lambda x: x[1])
-        worst_user = sorted_users[0][0] if sorted_users else None
-        best_user = sorted_users[-1][0] if sorted_users else None
-
-        avg_min = float(np.mean(min_scores)) if min_scores else 0
-        variance = float(np.var(list(user_avg_scores.values()))) if user_avg_scores else 0
+        avg_min = float(min_scores.mean()) if min_scores.size else 0
+        variance = float(user_means.var()) if user_means.size else 0
 
         return {
             'avg_min_score': avg_min,
             'score_variance': variance,
-            'worst_user': worst_user,
-            'worst_user_score': user_avg_scores.get(worst_user, 0),
-            'best_user': best_user,
-            'best_user_score': user_avg_scores.get(best_user, 0),
-            'user_scores': user_avg_scores,
+            'worst_user': names[worst_i],
+            'worst_user_score': float(user_means[worst_i]),
+            'best_user': names[best_i],
+            'best_user_score': float(user_means[best_i]),
+            'user_scores': dict(zip(names, user_means.tolist())),
             'is_fair': avg_min > 0.4 and variance < 0.1
         }
 
@@ -412,9 +694,7 @@ class RecommendationEvaluator:
         for round_num in range(1, n_rounds + 1):
             if round_num == 1:
                 # İlk round: normal recommendation
-                recs = self.recommender.recommend_fair(
-                    test_participants, n_results=top_k
-                )
+                recs = self._recommend(test_participants, n_results=top_k)
             else:
                 # Sonraki roundlar: feedback-aware recommendation
                 participants_dict = [
@@ -428,7 +708,7 @@ class RecommendationEvaluator:
                     n_results=top_k
                 )
 
-            movie_ids = set(r['movie_id'] for r in recs[:top_k])
+            movie_ids = {r['movie_id'] for r in recs[:top_k]}
             repeats = movie_ids & all_seen
             new_movies = movie_ids - all_seen
 
@@ -443,15 +723,15 @@ class RecommendationEvaluator:
             total_repeats += len(repeats)
             total_recommended += len(movie_ids)
 
-            # Her filmi "like" olarak kaydet (seen olarak işaretle)
-            for mid in movie_ids:
-                for p in test_participants:
-                    feedback_learner.record_swipe(
-                        session_id=session_id,
-                        user_name=p['name'],
-                        movie_id=mid,
-                        action='like'
-                    )
+            # Her filmi "like" olarak kaydet (seen olarak işaretle), kullanıcı başına tek çağrı
+            round_ids = list(movie_ids)
+            for p in test_participants:
+                feedback_learner.record_swipes_batch(
+                    session_id=session_id,
+                    user_name=p['name'],
+                    movie_ids=round_ids,
+                    action='like'
+                )
 
             all_seen.update(movie_ids)
 
@@ -488,6 +768,10 @@ class RecommendationEvaluator:
                 'timestamp': str
             }
         """
+        # Önceki run'ın önerileri kullanılmasın (katalog / model değişmiş olabilir)
+        with self._rec_lock:
+            self._rec_cache.clear()
+
         if verbose:
             print("\n" + "=" * 60)
             print("🎬 CINEMATCH EVALUATION PIPELINE")
@@ -518,41 +802,37 @@ class RecommendationEvaluator:
             'summary': {}
         }
 
-        # 1. Consistency
+        # 1-4: Consistency, Genre Alignment, Diversity, Fairness paralel çalışır.
+        # Hepsi read-only (embedding + vector store sorguları), zaman I/O'da geçiyor
         if verbose:
             print("\n📊 Testing CONSISTENCY...")
-
-        results['consistency'] = {
-            'solo': self.evaluate_consistency(solo_user),
-            'diverse_group': self.evaluate_consistency(diverse_group),
-            'similar_group': self.evaluate_consistency(similar_group)
-        }
-
-        # 2. Genre Alignment
-        if verbose:
             print("🎭 Testing GENRE ALIGNMENT...")
-
-        results['genre_alignment'] = self.evaluate_genre_alignment()
-
-        # 3. Diversity
-        if verbose:
             print("🌈 Testing DIVERSITY...")
-
-        results['diversity'] = {
-            'solo': self.evaluate_diversity(solo_user),
-            'diverse_group': self.evaluate_diversity(diverse_group)
-        }
-
-        # 4. Fairness
-        if verbose:
             print("⚖️ Testing FAIRNESS...")
 
-        results['fairness'] = {
-            'diverse_group': self.evaluate_fairness(diverse_group),
-            'similar_group': self.evaluate_fairness(similar_group)
-        }
+        with ThreadPoolExecutor(max_workers=self.EVAL_WORKERS) as executor:
+            consistency = {
+                'solo': executor.submit(self.evaluate_consistency, solo_user),
+                'diverse_group': executor.submit(self.evaluate_consistency, diverse_group),
+                'similar_group': executor.submit(self.evaluate_consistency, similar_group)
+            }
+            genre_alignment = executor.submit(self.evaluate_genre_alignment)
+            diversity = {
+                'solo': executor.submit(self.evaluate_diversity, solo_user),
+                'diverse_group': executor.submit(self.evaluate_diversity, diverse_group)
+            }
+            fairness = {
+                'diverse_group': executor.submit(self.evaluate_fairness, diverse_group),
+                'similar_group': executor.submit(self.evaluate_fairness, similar_group)
+            }
+
+            results['consistency'] = {k: f.result() for k, f in consistency.items()}
+            results['genre_alignment'] = genre_alignment.result()
+            results['diversity'] = {k: f.result() for k, f in diversity.items()}
+            results['fairness'] = {k: f.result() for k, f in fairness.items()}
 
-        # 5. Feedback Loop (repeat prevention)
+        # 5. Feedback Loop (repeat prevention) - FeedbackLearner session state'i
+        # tuttuğu için seri çalışır
         if verbose:
             print("🔄 Testing FEEDBACK LOOP...")
 
@@ -578,15 +858,19 @@ class RecommendationEvaluator:
             for k in results['feedback_loop']
         ]
 
+        # Birkaç elemanlı listeler: numpy array oluşturma overhead'i yerine statistics.fmean
+        avg_consistency = fmean(consistency_scores)
+        avg_alignment = fmean(alignment_scores) if alignment_scores else 0
+
         results['summary'] = {
-            'avg_consistency': float(np.mean(consistency_scores)),
-            'avg_genre_alignment': float(np.mean(alignment_scores)) if alignment_scores else 0,
+            'avg_consistency': avg_consistency,
+            'avg_genre_alignment': avg_alignment,
             'diverse_group_fairness': results['fairness']['diverse_group']['avg_min_score'],
             'diverse_group_diversity': results['diversity']['diverse_group']['unique_genre_count'],
-            'feedback_repeat_rate': float(np.mean(feedback_repeat_rates)),
+            'feedback_repeat_rate': fmean(feedback_repeat_rates),
             'all_tests_passed': all([
-                np.mean(consistency_scores) > 0.8,
-                np.mean(alignment_scores) > 0.6 if alignment_scores else True,
+                avg_consistency > 0.8,
+                avg_alignment > 0.6 if alignment_scores else True,
                 results['fairness']['diverse_group']['avg_min_score'] > 0.4,
                 results['diversity']['diverse_group']['unique_genre_count'] >= 4,
                 all(r == 0 for r in feedback_repeat_rates)
@@ -9,10 +9,145 @@ refined = original + like_weight * liked_centroid - dislike_weight * disliked_ce
 refined = normalize(refined)
 """
 
+import logging
+import math
+import threading
+import time
 import numpy as np
-from typing import Dict, List, Optional
+from typing import AbstractSet, Dict, List, Optional, Set, Tuple
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+
+try:  # Opsiyonel: numba kuruluysa refine kernel'i (centroid + shift + normalize) native loop
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _refine_np(init, mat, like_rows, dis_rows, like_weight, dislike_weight):
+    """refined = normalize(init + wl * mean(liked) - wd * mean(disliked)), float32"""
+    refined = np.array(init, dtype=np.float32)  # her zaman kopya
+
+    # İki centroid tek gather + tek GEMV: mean'in 1/N'i ve weight satır katsayısına katlanır
+    # (coef @ rows = wl * mean(liked) - wd * mean(disliked)); ayrı mean / scale buffer'ı yok
+    n_like, n_dis = like_rows.size, dis_rows.size
+    if n_like or n_dis:
+        coef = np.empty(n_like + n_dis, dtype=np.float32)
+        if n_like:
+            coef[:n_like] = like_weight / n_like
+        if n_dis:
+            coef[n_like:] = -dislike_weight / n_dis
+        refined += coef @ mat[np.concatenate((like_rows, dis_rows))]
+
+    # Normalize (cosine similarity için önemli); squared norm tek dot ile
+    sq_norm = float(refined @ refined)
+    if sq_norm > 0:
+        refined *= 1.0 / math.sqrt(sq_norm)
+    return refined
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _refine(init, mat, like_rows, dis_rows, like_weight, dislike_weight):
+        n_dims = init.shape[0]
+        refined = init.copy()
+        # mean * weight tek scalar'a katlanır: satırlar doğrudan refined'a eklenir
+        if like_rows.size:
+            scale = like_weight / like_rows.size
+            for r in like_rows:
+                for j in range(n_dims):
+                    refined[j] += scale * mat[r, j]
+        if dis_rows.size:
+            scale = dislike_weight / dis_rows.size
+            for r in dis_rows:
+                for j in range(n_dims):
+                    refined[j] -= scale * mat[r, j]
+        sq_norm = 0.0
+        for j in range(n_dims):
+            sq_norm += refined[j] * refined[j]
+        if sq_norm > 0:
+            inv = 1.0 / np.sqrt(sq_norm)
+            for j in range(n_dims):
+                refined[j] *= inv
+        return refined
+else:
+    _refine = _refine_np
+
+
+# calculate_matches action matrix kodları (0 = swipe yok)
+_ACTION_CODES = {'like': 1, 'dislike': -1, 'skip': 2}
+_ACTION_NAMES = {code: action for action, code in _ACTION_CODES.items()}
+
+
+def _action_code(action: str) -> int:
+    """Bilinmeyen action'lar skip sayılır (match hesabında nötr)"""
+    return _ACTION_CODES.get(action, _ACTION_CODES['skip'])
+
+
+class _UserSwipes:
+    """
+    Bir kullanıcının swipe'ları, SoA: movie_id (int64), action kodu (int8), timestamp
+    (float64 epoch) paralel array'leri + movie_id -> row. Kapasite dolunca ikiye katlanır;
+    swipe başına dict yerine 17 byte. Film başına tek kayıt (tekrar swipe günceller).
+    """
+    __slots__ = ("movie_ids", "actions", "timestamps", "n", "row")
+
+    def __init__(self, capacity: int = 16):
+        self.movie_ids = np.empty(capacity, dtype=np.int64)
+        self.actions = np.empty(capacity, dtype=np.int8)
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.n = 0
+        self.row: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self.n
+
+    def record(self, movie_id: int, code: int, timestamp: float) -> None:
+        i = self.row.get(movie_id)
+        if i is None:
+            if self.n == len(self.movie_ids):
+                self._grow()
+            i = self.n
+            self.movie_ids[i] = movie_id
+            self.row[movie_id] = i
+            self.n += 1
+        self.actions[i] = code
+        self.timestamps[i] = timestamp
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self.movie_ids)
+        for name in ("movie_ids", "actions", "timestamps"):
+            old = getattr(self, name)
+            grown = np.empty(capacity, dtype=old.dtype)
+            grown[:self.n] = old[:self.n]
+            setattr(self, name, grown)
+
+    def ids_with(self, action: str) -> List[int]:
+        """Verilen action'lı filmler, swipe sırasıyla"""
+        n = self.n
+        return self.movie_ids[:n][self.actions[:n] == _ACTION_CODES[action]].tolist()
+
+    def action_counts(self) -> Dict[str, int]:
+        """Action başına swipe sayısı, tek bincount geçişiyle (kodlar -1..2 -> 0..3)"""
+        counts = np.bincount(self.actions[:self.n] + 1, minlength=4)
+        return {action: int(counts[code + 1]) for action, code in _ACTION_CODES.items()}
+
+    def as_dicts(self) -> List[Dict]:
+        """Eski format: [{'movie_id', 'action', 'timestamp'}] (sadece gerektiğinde üretilir)"""
+        n = self.n
+        return [
+            {
+                'movie_id': movie_id,
+                'action': _ACTION_NAMES[code],
+                'timestamp': datetime.fromtimestamp(ts).isoformat()
+            }
+            for movie_id, code, ts in zip(
+                self.movie_ids[:n].tolist(), self.actions[:n].tolist(), self.timestamps[:n].tolist()
+            )
+        ]
+
 
 class FeedbackLearner:
     """
@@ -32,11 +167,23 @@ class FeedbackLearner:
         self.embedding_engine = embedding_engine
 
         # Session bazlı swipe storage
-        # session_id -> {user_name -> [swipes]}
-        self.session_swipes: Dict[str, Dict[str, List[Dict]]] = {}
+        # session_id -> {user_name -> _UserSwipes}; duplicate kontrolü _UserSwipes.row ile O(1)
+        self.session_swipes: Dict[str, Dict[str, _UserSwipes]] = {}
+
+        # session_id -> görülen film ID'leri (record_swipe ile artımlı tutulur)
+        self._seen: Dict[str, Set[int]] = {}
 
-        # Film embedding cache (ChromaDB'den çekilen)
-        self._film_embedding_cache: Dict[int, np.ndarray] = {}
+        # Film embedding cache (ChromaDB'den çekilen): tek contiguous (N, D) float32 matris
+        # + movie_id -> row; centroid'ler satır gather'ıyla, vektör başına ayrı ndarray yok
+        self._emb_matrix: Optional[np.ndarray] = None  # ilk fetch'te D belli olunca allocate
+        self._emb_row: Dict[int, int] = {}
+        self._emb_lock = threading.Lock()
+
+        if njit is not None:
+            # JIT warm-up (cache=True ile sonraki process'lerde diskten yüklenir)
+            no_rows = np.empty(0, dtype=np.int64)
+            _refine(np.ones(2, dtype=np.float32), np.ones((1, 2), dtype=np.float32),
+                    np.zeros(1, dtype=np.int64), no_rows, 0.3, 0.2)
 
     def record_swipe(
         self,
@@ -51,52 +198,93 @@ class FeedbackLearner:
         Returns:
             {"recorded": True, "total_swipes": int}
         """
-        if session_id not in self.session_swipes:
-            self.session_swipes[session_id] = {}
+        user_swipes = self._user_storage(session_id, user_name)
 
-        if user_name not in self.session_swipes[session_id]:
-            self.session_swipes[session_id][user_name] = []
-
-        # Aynı film için duplicate swipe kontrolü
-        existing = [s for s in self.session_swipes[session_id][user_name]
-                   if s['movie_id'] == movie_id]
-        if existing:
-            # Güncelle
-            existing[0]['action'] = action
-            existing[0]['timestamp'] = datetime.now().isoformat()
-        else:
-            # Yeni ekle
-            self.session_swipes[session_id][user_name].append({
-                'movie_id': movie_id,
-                'action': action,
-                'timestamp': datetime.now().isoformat()
-            })
+        # Aynı film için tekrar swipe mevcut kaydı günceller
+        user_swipes.record(movie_id, _action_code(action), time.time())
+
+        self._seen.setdefault(session_id, set()).add(movie_id)
+
+        return {"recorded": True, "total_swipes": len(user_swipes)}
 
-        total = len(self.session_swipes[session_id][user_name])
-        return {"recorded": True, "total_swipes": total}
+    def _user_storage(self, session_id: str, user_name: str) -> _UserSwipes:
+        """Kullanıcının swipe storage'ı (yoksa oluşturulur)"""
+        users = self.session_swipes.setdefault(session_id, {})
+        user_swipes = users.get(user_name)
+        if user_swipes is None:
+            user_swipes = users[user_name] = _UserSwipes()
+        return user_swipes
 
-    def _get_film_embedding(self, movie_id: int) -> Optional[np.ndarray]:
+    def record_swipes_batch(
+        self,
+        session_id: str,
+        user_name: str,
+        movie_ids: List[int],
+        action: str
+    ) -> Dict:
         """
-        Film embedding'ini al (cache veya ChromaDB'den).
+        Aynı kullanıcının birden fazla filme aynı action'ı tek çağrıda.
+        record_swipe ile aynı semantik (mevcut swipe güncellenir).
+
+        Returns:
+            {"recorded": True, "total_swipes": int}
         """
-        if movie_id in self._film_embedding_cache:
-            return self._film_embedding_cache[movie_id]
+        user_swipes = self._user_storage(session_id, user_name)
+        code = _action_code(action)
+        timestamp = time.time()
 
-        # ChromaDB'den al
+        for movie_id in movie_ids:
+            user_swipes.record(movie_id, code, timestamp)
+
+        self._seen.setdefault(session_id, set()).update(movie_ids)
+        return {"recorded": True, "total_swipes": len(user_swipes)}
+
+    def _fetch_film_embeddings(self, movie_ids: List[int]) -> None:
+        """Cache'te olmayan film embedding'lerini tek ChromaDB çağrısında çekip cache'le"""
+        missing = [mid for mid in dict.fromkeys(movie_ids) if mid not in self._emb_row]
+        if not missing:
+            return
         try:
             result = self.embedding_engine.vector_store.collection.get(
-                ids=[str(movie_id)],
+                ids=[str(mid) for mid in missing],
                 include=["embeddings"]
             )
-
-            if result['embeddings'] and len(result['embeddings']) > 0:
-                embedding = np.array(result['embeddings'][0])
-                self._film_embedding_cache[movie_id] = embedding
-                return embedding
+            embeddings = result['embeddings']
+            if embeddings is not None and len(embeddings):
+                # ChromaDB sırayı garanti etmez, id ile eşle
+                self._insert_film_embeddings(
+                    [int(doc_id) for doc_id in result['ids']],
+                    np.asarray(embeddings, dtype=np.float32)
+                )
         except Exception as e:
-            print(f"Error getting embedding for movie {movie_id}: {e}")
-
-        return None
+            logger.warning("Error getting embeddings for %d movies: %s", len(missing), e)
+
+    def _insert_film_embeddings(self, movie_ids: List[int], embeddings: np.ndarray) -> None:
+        """Yeni embedding'leri matrisin sonuna yaz; kapasite yetmezse ikiye katla"""
+        with self._emb_lock:
+            new = [(mid, i) for i, mid in enumerate(movie_ids) if mid not in self._emb_row]
+            if not new:
+                return
+            n_rows = len(self._emb_row)
+            if self._emb_matrix is None:
+                capacity = max(1024, len(new))
+                self._emb_matrix = np.empty((capacity, embeddings.shape[1]), dtype=np.float32)
+            elif n_rows + len(new) > len(self._emb_matrix):
+                capacity = max(2 * len(self._emb_matrix), n_rows + len(new))
+                grown = np.empty((capacity, self._emb_matrix.shape[1]), dtype=np.float32)
+                grown[:n_rows] = self._emb_matrix[:n_rows]
+                self._emb_matrix = grown
+
+            src = [i for _, i in new]
+            self._emb_matrix[n_rows:n_rows + len(new)] = embeddings[src]
+            # Satır yazıldıktan sonra index'e ekle (okuyan thread yarım satır görmesin)
+            for offset, (mid, _) in enumerate(new):
+                self._emb_row[mid] = n_rows + offset
+
+    def _film_rows(self, movie_ids: List[int]) -> np.ndarray:
+        """Cache'teki filmlerin embedding matrisi satırları (int64); bulunamayanlar atlanır"""
+        emb_row = self._emb_row
+        return np.asarray([emb_row[mid] for mid in movie_ids if mid in emb_row], dtype=np.int64)
 
     def get_refined_embedding(
         self,
@@ -133,63 +321,46 @@ class FeedbackLearner:
         if len(swipes) < min_swipes:
             return initial_embedding
 
-        # Like ve dislike'ları ayır
-        liked_ids = [s['movie_id'] for s in swipes if s['action'] == 'like']
-        disliked_ids = [s['movie_id'] for s in swipes if s['action'] == 'dislike']
-
-        # Embedding'leri al
-        liked_embeddings = []
-        for movie_id in liked_ids:
-            emb = self._get_film_embedding(movie_id)
-            if emb is not None:
-                liked_embeddings.append(emb)
-
-        disliked_embeddings = []
-        for movie_id in disliked_ids:
-            emb = self._get_film_embedding(movie_id)
-            if emb is not None:
-                disliked_embeddings.append(emb)
-
-        # Centroid hesapla ve shift
-        refined = initial_embedding.copy().astype(np.float64)
+        # Like ve dislike'ları ayır (action array'i üzerinde mask)
+        liked_ids = swipes.ids_with('like')
+        disliked_ids = swipes.ids_with('dislike')
 
-        if liked_embeddings:
-            liked_centroid = np.mean(liked_embeddings, axis=0)
-            refined = refined + like_weight * liked_centroid
+        # Embedding'leri al: cache'te olmayanlar tek ChromaDB çağrısında
+        self._fetch_film_embeddings(liked_ids + disliked_ids)
+        like_rows = self._film_rows(liked_ids)
+        dis_rows = self._film_rows(disliked_ids)
 
-        if disliked_embeddings:
-            disliked_centroid = np.mean(disliked_embeddings, axis=0)
-            refined = refined - dislike_weight * disliked_centroid
+        init = np.asarray(initial_embedding, dtype=np.float32)
+        mat = self._emb_matrix
+        if mat is None:
+            mat = np.empty((0, init.shape[0]), dtype=np.float32)
 
-        # Normalize (cosine similarity için önemli)
-        norm = np.linalg.norm(refined)
-        if norm > 0:
-            refined = refined / norm
+        # Centroid + shift + normalize tek kernel'de (numba varsa native, yoksa numpy; float32)
+        return _refine(init, mat, like_rows, dis_rows, float(like_weight), float(dislike_weight))
 
-        return refined
-
-    def get_seen_films(self, session_id: str) -> List[int]:
+    def get_seen_films_set(self, session_id: str) -> AbstractSet[int]:
         """
-        Session'da görülen tüm filmlerin ID'leri.
-        Bu filmler tekrar önerilmemeli.
+        Session'da görülen tüm filmlerin ID'leri (O(1) membership, filter path'leri için).
+        Bu filmler tekrar önerilmemeli. Dönen set read-only kullanılmalı.
         """
-        if session_id not in self.session_swipes:
-            return []
+        return self._seen.get(session_id, frozenset())
 
-        seen = set()
-        for user_swipes in self.session_swipes[session_id].values():
-            for swipe in user_swipes:
-                seen.add(swipe['movie_id'])
+    def get_seen_films(self, session_id: str) -> List[int]:
+        """Görülen filmler list olarak (API response'ları için)"""
+        return list(self.get_seen_films_set(session_id))
 
-        return list(seen)
+    def _user_swipes(self, session_id: str, user_name: str) -> Optional[_UserSwipes]:
+        return self.session_swipes.get(session_id, {}).get(user_name)
 
     def get_user_swipes(self, session_id: str, user_name: str) -> List[Dict]:
-        """Belirli kullanıcının swipe'larını al"""
-        if session_id not in self.session_swipes:
-            return []
-        if user_name not in self.session_swipes[session_id]:
-            return []
-        return self.session_swipes[session_id][user_name]
+        """Belirli kullanıcının swipe'larını al ([{'movie_id', 'action', 'timestamp'}], yeni list)"""
+        swipes = self._user_swipes(session_id, user_name)
+        return swipes.as_dicts() if swipes is not None else []
+
+    def get_user_movie_ids(self, session_id: str, user_name: str, action: str) -> List[int]:
+        """Kullanıcının verilen action ile swipe'ladığı filmler (swipe sırasıyla), dict üretmeden"""
+        swipes = self._user_swipes(session_id, user_name)
+        return swipes.ids_with(action) if swipes is not None else []
 
     def get_session_stats(self, session_id: str) -> Dict:
         """
@@ -211,26 +382,32 @@ class FeedbackLearner:
 
         stats = {}
         for user_name, swipes in self.session_swipes[session_id].items():
+            counts = swipes.action_counts()
             stats[user_name] = {
                 'total': len(swipes),
-                'likes': len([s for s in swipes if s['action'] == 'like']),
-                'dislikes': len([s for s in swipes if s['action'] == 'dislike']),
-                'skips': len([s for s in swipes if s['action'] == 'skip'])
+                'likes': counts['like'],
+                'dislikes': counts['dislike'],
+                'skips': counts['skip']
             }
 
         return stats
 
+    def get_session_snapshot(self, session_id: str) -> Tuple[Dict, List[int]]:
+        """(get_session_stats, get_seen_films) tek çağrıda"""
+        return self.get_session_stats(session_id), self.get_seen_films(session_id)
+
     def clear_session(self, session_id: str) -> bool:
         """Session verilerini temizle"""
         if session_id in self.session_swipes:
             del self.session_swipes[session_id]
+            self._seen.pop(session_id, None)
             return True
         return False
 
     def is_feedback_ready(self, session_id: str, user_name: str, min_swipes: int = 3) -> bool:
         """Kullanıcının yeterli swipe'ı var mı?"""
-        swipes = self.get_user_swipes(session_id, user_name)
-        return len(swipes) >= min_swipes
+        swipes = self._user_swipes(session_id, user_name)
+        return swipes is not None and len(swipes) >= min_swipes
 
     def calculate_matches(self, session_id: str) -> Dict:
         """
@@ -262,63 +439,53 @@ class FeedbackLearner:
         if user_count == 0:
             return {"perfect": [], "majority": []}
 
-        # Collect all movie_ids that were swiped
-        all_movie_ids = set()
-        for user_swipes in self.session_swipes[session_id].values():
-            for swipe in user_swipes:
-                all_movie_ids.add(swipe['movie_id'])
-
-        perfect = []
+        # User x movie action matrix (0 = no swipe): her kullanıcının int8 action array'i
+        # doğrudan kendi film kolonlarına tek fancy-index ataması ile yazılır.
+        # _UserSwipes film başına tek kayıt tuttuğu için aynı hücreye iki kez yazılmaz
+        movie_idx: Dict[int, int] = {}
+        user_cols = []
+        for user_name in all_users:
+            swipes = self.session_swipes[session_id][user_name]
+            user_cols.append([
+                movie_idx.setdefault(movie_id, len(movie_idx))
+                for movie_id in swipes.movie_ids[:swipes.n].tolist()
+            ])
+        movie_ids = list(movie_idx)
+
+        actions = np.zeros((user_count, len(movie_ids)), dtype=np.int8)
+        for u, (user_name, cols) in enumerate(zip(all_users, user_cols)):
+            swipes = self.session_swipes[session_id][user_name]
+            actions[u, cols] = swipes.actions[:swipes.n]
+
+        # Skip if vetoed (someone disliked); need at least one like to consider it a match
+        likes = (actions == _ACTION_CODES['like']).sum(axis=0)
+        valid = ~(actions == _ACTION_CODES['dislike']).any(axis=0) & (likes > 0)
+        # Perfect match: everyone liked. Majority match: 75%+ liked
+        perfect_cols = np.flatnonzero(valid & (likes == user_count))
+        majority_cols = np.flatnonzero(valid & (likes < user_count) & (likes * 100 >= 75 * user_count))
+
+        def votes_for(j: int) -> Dict[str, str]:
+            return {all_users[u]: _ACTION_NAMES[int(actions[u, j])] for u in np.flatnonzero(actions[:, j])}
+
+        perfect = [
+            {
+                "movie_id": movie_ids[j],
+                "votes": votes_for(j),
+                "match_percentage": 100
+            }
+            for j in perfect_cols
+        ]
         majority = []
-
-        for movie_id in all_movie_ids:
-            votes = {}
-            like_count = 0
-            has_veto = False
-            voters_count = 0
-
-            for user_name in all_users:
-                user_swipes = self.session_swipes[session_id].get(user_name, [])
-                swipe = next((s for s in user_swipes if s['movie_id'] == movie_id), None)
-
-                if swipe:
-                    action = swipe['action']
-                    votes[user_name] = action
-
-                    if action == 'like':
-                        like_count += 1
-                        voters_count += 1
-                    elif action == 'dislike':
-                        has_veto = True
-                        voters_count += 1
-                    # skip doesn't count as voter
-
-            # Skip if vetoed (someone disliked)
-            if has_veto:
-                continue
-
-            # Need at least one like to consider it a match
-            if like_count == 0:
-                continue
-
+        for j in majority_cols:
+            like_count = int(likes[j])
             # Calculate match percentage (likes / total users)
             percentage = (like_count / user_count) * 100
-
-            # Perfect match: everyone liked
-            if like_count == user_count:
-                perfect.append({
-                    "movie_id": movie_id,
-                    "votes": votes,
-                    "match_percentage": 100
-                })
-            # Majority match: 75%+ liked
-            elif percentage >= 75:
-                majority.append({
-                    "movie_id": movie_id,
-                    "votes": votes,
-                    "match_percentage": round(percentage, 1),
-                    "liked_count": like_count,
-                    "total_voters": voters_count
-                })
+            majority.append({
+                "movie_id": movie_ids[j],
+                "votes": votes_for(j),
+                "match_percentage": round(percentage, 1),
+                "liked_count": like_count,
+                "total_voters": like_count  # veto yok, skip voter sayılmıyor
+            })
 
         return {"perfect": perfect, "majority": majority}
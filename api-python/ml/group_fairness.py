@@ -7,8 +7,15 @@ fairness-aware birleştirme ile adil öneriler sunar.
 Part 2: Feedback Loop entegrasyonu ile swipe verilerinden öğrenme.
 """
 
+import functools
+import heapq
+import sys
+import threading
+from collections import OrderedDict
+from itertools import islice
+from operator import itemgetter
 import numpy as np
-from typing import List, Dict, Optional, TYPE_CHECKING
+from typing import List, Dict, Optional, Tuple, TYPE_CHECKING
 from ml.embeddings import EmbeddingEngine
 
 if TYPE_CHECKING:
@@ -24,8 +31,14 @@ class FairGroupRecommender:
     Bu yaklaşım herkesin en az biraz memnun olacağı filmleri seçer.
     """
 
+    QUERY_EMBEDDING_CACHE_SIZE = 256
+
     def __init__(self, embedding_engine: EmbeddingEngine):
         self.embedding_engine = embedding_engine
+        # (query, model_id) -> embedding; aynı mood/note'lu katılımcılar ve tekrar eden
+        # istekler transformer'ı yeniden çalıştırmaz (LRU, request thread'leri arasında paylaşımlı)
+        self._query_embedding_cache: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self._query_embedding_lock = threading.Lock()
 
     # Mood → Semantic expansion map
     # Embedding search'de daha iyi sonuçlar almak için
@@ -56,16 +69,56 @@ class FairGroupRecommender:
         Örnek:
             "uplifting" → "uplifting feel-good heartwarming inspiring positive comedy family"
         """
-        # Mood'ları semantik olarak genişlet
-        expanded_moods = []
-        for mood in (moods or []):
-            expanded = self.MOOD_EXPANSION.get(mood, mood)
-            expanded_moods.append(expanded)
+        return self._build_query_cached(tuple(moods or ()), note or "")
 
-        mood_text = " ".join(expanded_moods) if expanded_moods else ""
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def _build_query_cached(moods: Tuple[str, ...], note: str) -> str:
+        mood_text = FairGroupRecommender._expand_moods(moods)
         note_text = note.strip() if note else ""
+        if not note_text:
+            return mood_text
         return f"{mood_text} {note_text}".strip()
 
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _expand_moods(moods: Tuple[str, ...]) -> str:
+        """
+        Mood'ları semantik olarak genişlet. Note'tan bağımsız cache'lenir: farklı
+        note'lu ama aynı mood'lu katılımcılar join'i tekrar yapmaz. Sonuç intern'lenir.
+        """
+        expansion = FairGroupRecommender.MOOD_EXPANSION
+        return sys.intern(" ".join(expansion.get(mood, mood) for mood in moods).strip())
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        embed_batch ama LRU cache'li: aynı çağrıdaki tekrar eden query'ler ve
+        önceden embed edilmişler bir kez encode edilir; kalanlar tek forward pass'te.
+        """
+        model_id = self.embedding_engine.model_id
+        keys = [(q, model_id) for q in queries]
+        cache = self._query_embedding_cache
+        with self._query_embedding_lock:
+            found = {}
+            for key in keys:
+                if key in cache:
+                    cache.move_to_end(key)
+                    found[key] = cache[key]
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+
+        if missing:
+            fresh = self.embedding_engine.embed_batch([q for q, _ in missing])
+            with self._query_embedding_lock:
+                for key, emb in zip(missing, fresh):
+                    found[key] = emb
+                    cache[key] = emb
+                    cache.move_to_end(key)
+                while len(cache) > self.QUERY_EMBEDDING_CACHE_SIZE:
+                    cache.popitem(last=False)
+
+        # Her çağırana kendi kopyası (cache'teki list'ler değiştirilmesin)
+        return [list(found[key]) for key in keys]
+
     def get_user_candidates(self, query: str, n_results: int = 30) -> Dict[int, float]:
         """
         Tek kullanıcı için candidate filmler ve similarity skorları.
@@ -76,20 +129,17 @@ class FairGroupRecommender:
         if not query:
             return {}
 
-        results = self.embedding_engine.search_similar_movies(query, top_k=n_results)
-
-        candidates = {}
-        for movie in results:
-            candidates[movie["id"]] = movie["similarity"]
-
-        return candidates
+        # Sadece id + similarity gerekiyor, metadata çekilmez
+        embedding = self.embedding_engine.embed_query(query)
+        return dict(self.embedding_engine.vector_store.query_similar_ids(embedding, n_results))
 
     def recommend_fair(
         self,
         participants: List[Dict],
         n_candidates: int = 30,
         n_results: int = 30,
-        fairness_weight: float = 0.5
+        fairness_weight: float = 0.5,
+        participant_embeddings: Optional[List[Optional[List[float]]]] = None
     ) -> List[Dict]:
         """
         Fairness-aware group recommendation.
@@ -99,6 +149,8 @@ class FairGroupRecommender:
             n_candidates: Her kullanıcı için kaç candidate çekilecek
             n_results: Final kaç film döndürülecek
             fairness_weight: 0=pure average, 1=pure least misery
+            participant_embeddings: embed_participants() çıktısı; verilirse query'ler
+                                    yeniden embed edilmez (aynı grup tekrar sorgulanırken)
 
         Returns:
             [{
@@ -108,76 +160,165 @@ class FairGroupRecommender:
                 "min_score": float,
                 "individual_scores": {user_name: score, ...}
             }, ...]
+            Already sorted by fair_score (desc), so callers can slice [:k]
+            for top-k without sorting again.
         """
 
         # SOLO MODE: Tek kişiyse fairness hesaplama, direkt dön
-        if len(participants) == 1:
+        if len(participants) == 1 and participant_embeddings is None:
             user = participants[0]
             query = self.build_query(
                 user.get("moods", []),
                 user.get("note", "")
             )
             candidates = self.get_user_candidates(query, n_candidates)
+            return self._solo_results(user.get("name", "User"), candidates, n_results)
 
-            user_name = user.get("name", "User")
-            return [
-                {
-                    "movie_id": movie_id,
-                    "fair_score": score,
-                    "avg_score": score,
-                    "min_score": score,
-                    "individual_scores": {user_name: score}
-                }
-                for movie_id, score in sorted(
-                    candidates.items(),
-                    key=lambda x: x[1],
-                    reverse=True
-                )[:n_results]
-            ]
-
-        # GROUP MODE: Her kullanıcı için ayrı candidate çek
-        all_candidates: Dict[int, Dict[str, float]] = {}  # movie_id -> {user_name: score}
+        if participant_embeddings is None:
+            participant_embeddings = self.embed_participants(participants)
+        query_idx = [i for i, emb in enumerate(participant_embeddings) if emb is not None]
+        embeddings = [participant_embeddings[i] for i in query_idx]
 
-        for user in participants:
-            user_name = user.get("name", "User")
-            query = self.build_query(
-                user.get("moods", []),
-                user.get("note", "")
+        if len(participants) == 1:
+            results = self.embedding_engine.vector_store.query_similar_ids_batch(
+                embeddings, n_results=n_candidates
             )
+            candidates = dict(results[0]) if results else {}
+            return self._solo_results(participants[0].get("name", "User"), candidates, n_results)
 
-            user_candidates = self.get_user_candidates(query, n_candidates)
-
-            for movie_id, score in user_candidates.items():
+        # GROUP MODE: Her kullanıcı için ayrı candidate çek
+        all_candidates: Dict[int, Dict[str, float]] = {}  # movie_id -> {user_name: score}
+        # Tüm kullanıcılar tek vector store query'sinde
+        batch_results = self.embedding_engine.vector_store.query_similar_ids_batch(
+            embeddings,
+            n_results=n_candidates
+        )
+
+        for i, results in zip(query_idx, batch_results):
+            user_name = participants[i].get("name", "User")
+            for movie_id, similarity in results:
                 if movie_id not in all_candidates:
                     all_candidates[movie_id] = {}
-                all_candidates[movie_id][user_name] = score
+                all_candidates[movie_id][user_name] = similarity
 
         # Fairness skoru hesapla
-        scored_films = []
         user_names = [u.get("name", f"User{i}") for i, u in enumerate(participants)]
+        return self._rank_fair(all_candidates, user_names, fairness_weight, n_results)
 
-        for movie_id, user_scores in all_candidates.items():
-            # Her kullanıcının skoru (yoksa 0)
-            scores = [user_scores.get(name, 0.0) for name in user_names]
-
-            avg_score = float(np.mean(scores))
-            min_score = float(min(scores))
-
-            # Least Misery formula
-            fair_score = (1 - fairness_weight) * avg_score + fairness_weight * min_score
-
-            scored_films.append({
+    def embed_participants(self, participants: List[Dict]) -> List[Optional[List[float]]]:
+        """
+        Her katılımcının query embedding'i (query boşsa None). Tüm query'ler
+        tek encode çağrısında embed edilir (kullanıcı başına ayrı forward pass yok).
+        """
+        queries = [
+            self.build_query(user.get("moods", []), user.get("note", ""))
+            for user in participants
+        ]
+        query_idx = [i for i, q in enumerate(queries) if q]
+        embeddings: List[Optional[List[float]]] = [None] * len(participants)
+        for i, emb in zip(query_idx, self._embed_queries([queries[i] for i in query_idx])):
+            embeddings[i] = emb
+        return embeddings
+
+    def recommend_solo_batch(
+        self,
+        users: List[Dict],
+        n_candidates: int = 30,
+        n_results: int = 30
+    ) -> List[List[Dict]]:
+        """
+        Birden fazla bağımsız solo isteği tek seferde: recommend_fair([user]) ile aynı
+        sonuçlar, ama tüm query'ler tek encode + tek vector store çağrısında.
+        (Evaluation'daki mood probe'ları gibi.)
+        """
+        user_embeddings = self.embed_participants(users)
+        query_idx = [i for i, emb in enumerate(user_embeddings) if emb is not None]
+        batch_results = self.embedding_engine.vector_store.query_similar_ids_batch(
+            [user_embeddings[i] for i in query_idx],
+            n_results=n_candidates
+        )
+
+        candidates_per_user: List[Dict[int, float]] = [{} for _ in users]
+        for i, results in zip(query_idx, batch_results):
+            candidates_per_user[i] = dict(results)
+        return [
+            self._solo_results(user.get("name", "User"), candidates, n_results)
+            for user, candidates in zip(users, candidates_per_user)
+        ]
+
+    @staticmethod
+    def _solo_results(user_name: str, candidates: Dict[int, float], n_results: int) -> List[Dict]:
+        """Solo mode: fairness yok, similarity'e göre ilk n_results"""
+        return [
+            {
                 "movie_id": movie_id,
-                "fair_score": fair_score,
-                "avg_score": avg_score,
-                "min_score": min_score,
-                "individual_scores": user_scores
-            })
-
-        # Fair score'a göre sırala
-        scored_films.sort(key=lambda x: x["fair_score"], reverse=True)
-
-        return scored_films[:n_results]
+                "fair_score": score,
+                "avg_score": score,
+                "min_score": score,
+                "individual_scores": {user_name: score}
+            }
+            for movie_id, score in heapq.nlargest(
+                n_results,
+                candidates.items(),
+                key=itemgetter(1)
+            )
+        ]
+
+    @staticmethod
+    def _rank_fair(
+        all_candidates: Dict[int, Dict[str, float]],
+        user_names: List[str],
+        fairness_weight: float,
+        n_results: int
+    ) -> List[Dict]:
+        """
+        Least Misery skorlarını (M filmler x U kullanıcılar) matris üzerinde
+        tek seferde hesapla ve fair_score'a göre ilk n_results'ı döndür.
+        Kullanıcının skoru yoksa 0 sayılır.
+        """
+        movie_ids = list(all_candidates.keys())
+
+        # İsim -> kolon(lar) index'i bir kez; aynı isimli katılımcılar aynı skoru alır
+        name_to_cols: Dict[str, List[int]] = {}
+        for col, name in enumerate(user_names):
+            name_to_cols.setdefault(name, []).append(col)
+
+        # Dense (M, U) matris: sadece var olan skorlar tek scatter'la yazılır
+        rows: List[int] = []
+        cols: List[int] = []
+        values: List[float] = []
+        for row, user_scores in enumerate(all_candidates.values()):
+            for name, score in user_scores.items():
+                for col in name_to_cols.get(name, ()):
+                    rows.append(row)
+                    cols.append(col)
+                    values.append(score)
+        scores = np.zeros((len(movie_ids), len(user_names)), dtype=np.float32)
+        scores[rows, cols] = values
+
+        avg = scores.mean(axis=1)
+        mn = scores.min(axis=1)
+        # Least Misery formula
+        fair = (1 - fairness_weight) * avg + fairness_weight * mn
+
+        # Top-K: argpartition ile K. skor eşiği O(M), sadece eşiği geçenler sıralanır
+        # (stable: eşit skorlarda ilk gelen önde, full sort ile aynı sonuç)
+        k = min(n_results, len(movie_ids))
+        if k <= 0:
+            return []
+        threshold = fair[np.argpartition(-fair, k - 1)[k - 1]]
+        top_idx = np.flatnonzero(fair >= threshold)
+        order = top_idx[np.argsort(-fair[top_idx], kind="stable")][:k]
+        return [
+            {
+                "movie_id": movie_ids[i],
+                "fair_score": float(fair[i]),
+                "avg_score": float(avg[i]),
+                "min_score": float(mn[i]),
+                "individual_scores": all_candidates[movie_ids[i]]
+            }
+            for i in order
+        ]
 
     def get_fairness_stats(self, recommendations: List[Dict], participants: List[Dict]) -> Dict:
         """
@@ -194,29 +335,37 @@ class FairGroupRecommender:
         if not recommendations or not participants:
             return {}
 
-        user_names = [u.get("name", f"User{i}") for i, u in enumerate(participants)]
+        # Aynı isimli katılımcılar tek kullanıcı sayılır
+        user_names = list(dict.fromkeys(
+            u.get("name", f"User{i}") for i, u in enumerate(participants)
+        ))
+        name_to_col = {name: j for j, name in enumerate(user_names)}
+
+        # (recs x users) skor matrisi, skoru olmayan = 0; var olan skorlar tek scatter'la
+        rows: List[int] = []
+        cols: List[int] = []
+        values: List[float] = []
+        for i, rec in enumerate(recommendations):
+            for name, score in rec.get("individual_scores", {}).items():
+                j = name_to_col.get(name)
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+                    values.append(score)
+        scores = np.zeros((len(recommendations), len(user_names)))
+        scores[rows, cols] = values
 
         # Her kullanıcının ortalama memnuniyeti
-        user_totals = {name: [] for name in user_names}
-
-        for rec in recommendations:
-            for name in user_names:
-                score = rec.get("individual_scores", {}).get(name, 0.0)
-                user_totals[name].append(score)
+        per_user = scores.mean(axis=0)
+        user_satisfaction = dict(zip(user_names, per_user.tolist()))
 
-        user_satisfaction = {
-            name: float(np.mean(scores)) if scores else 0.0
-            for name, scores in user_totals.items()
-        }
-
-        # En az ve en çok memnun olan
-        sorted_users = sorted(user_satisfaction.items(), key=lambda x: x[1])
-        least_satisfied = sorted_users[0][0] if sorted_users else None
-        most_satisfied = sorted_users[-1][0] if sorted_users else None
+        # En az ve en çok memnun olan (eşitlikte: en az = ilk, en çok = son; stable sort ile aynı)
+        least_satisfied = user_names[int(per_user.argmin())]
+        most_satisfied = user_names[len(user_names) - 1 - int(per_user[::-1].argmax())]
 
         # Overall fairness (1 - variance between user satisfactions)
-        if len(user_satisfaction) > 1:
-            variance = float(np.var(list(user_satisfaction.values())))
+        if len(user_names) > 1:
+            variance = float(per_user.var())
             overall_fairness = max(0.0, 1.0 - variance * 10)  # Scale variance
         else:
             overall_fairness = 1.0
@@ -264,7 +413,7 @@ class FairGroupRecommender:
             }, ...]
         """
         # Görülen filmleri al (exclude için)
-        seen_films = set(feedback_learner.get_seen_films(session_id))
+        seen_films = feedback_learner.get_seen_films_set(session_id)
 
         # SOLO MODE
         if len(participants) == 1:
@@ -276,8 +425,8 @@ class FairGroupRecommender:
             )
 
             # Original embedding
-            original_embedding = np.array(
-                self.embedding_engine.embed_query(query)
+            original_embedding = np.asarray(
+                self.embedding_engine.embed_query(query), dtype=np.float32
             )
 
             # Feedback varsa refine et
@@ -292,95 +441,73 @@ class FairGroupRecommender:
                 refined_embedding = original_embedding
 
             # Query with refined embedding
-            results = self.embedding_engine.vector_store.query_similar_movies(
+            results = self.embedding_engine.vector_store.query_similar_ids(
                 refined_embedding.tolist(),
                 n_results=n_candidates + len(seen_films)
             )
 
-            # Filter seen films
-            filtered_results = [
-                r for r in results
-                if r["id"] not in seen_films
-            ][:n_results]
+            # Filter seen films (n_results'a ulaşınca dur)
+            filtered_results = islice(
+                ((movie_id, similarity) for movie_id, similarity in results
+                 if movie_id not in seen_films),
+                n_results
+            )
 
             return [
                 {
-                    "movie_id": movie["id"],
-                    "fair_score": movie["similarity"],
-                    "avg_score": movie["similarity"],
-                    "min_score": movie["similarity"],
-                    "individual_scores": {user_name: movie["similarity"]},
+                    "movie_id": movie_id,
+                    "fair_score": similarity,
+                    "avg_score": similarity,
+                    "min_score": similarity,
+                    "individual_scores": {user_name: similarity},
                     "feedback_applied": feedback_applied
                 }
-                for movie in filtered_results
+                for movie_id, similarity in filtered_results
             ]
 
         # GROUP MODE: Her kullanıcı için feedback-aware query
         all_candidates: Dict[int, Dict[str, float]] = {}
         any_feedback_applied = False
 
-        for user in participants:
-            user_name = user.get("name", "User")
-            query = self.build_query(
-                user.get("moods", []),
-                user.get("note", "")
-            )
+        # Tüm query'ler tek encode çağrısında embed edilir
+        queries = [
+            self.build_query(user.get("moods", []), user.get("note", ""))
+            for user in participants
+        ]
+        original_embeddings = np.asarray(self._embed_queries(queries), dtype=np.float32)
 
-            # Original embedding
-            original_embedding = np.array(
-                self.embedding_engine.embed_query(query)
-            )
-
-            # Feedback varsa refine et
-            user_feedback_ready = feedback_learner.is_feedback_ready(session_id, user_name)
-            if user_feedback_ready:
+        # Feedback varsa her kullanıcının embedding'ini refine et
+        query_embeddings = []
+        for user, original_embedding in zip(participants, original_embeddings):
+            user_name = user.get("name", "User")
+            if feedback_learner.is_feedback_ready(session_id, user_name):
                 any_feedback_applied = True
-                refined_embedding = feedback_learner.get_refined_embedding(
+                original_embedding = feedback_learner.get_refined_embedding(
                     session_id=session_id,
                     user_name=user_name,
                     initial_embedding=original_embedding
                 )
-            else:
-                refined_embedding = original_embedding
+            query_embeddings.append(original_embedding.tolist())
 
-            # Query with refined embedding
-            results = self.embedding_engine.vector_store.query_similar_movies(
-                refined_embedding.tolist(),
-                n_results=n_candidates + len(seen_films)
-            )
+        # Tüm kullanıcılar tek vector store query'sinde
+        batch_results = self.embedding_engine.vector_store.query_similar_ids_batch(
+            query_embeddings,
+            n_results=n_candidates + len(seen_films)
+        )
 
-            for movie in results:
-                movie_id = movie["id"]
+        for user, results in zip(participants, batch_results):
+            user_name = user.get("name", "User")
+            for movie_id, similarity in results:
                 if movie_id in seen_films:
                     continue
 
                 if movie_id not in all_candidates:
                     all_candidates[movie_id] = {}
-                all_candidates[movie_id][user_name] = movie["similarity"]
+                all_candidates[movie_id][user_name] = similarity
 
         # Fairness skoru hesapla
-        scored_films = []
         user_names = [u.get("name", f"User{i}") for i, u in enumerate(participants)]
-
-        for movie_id, user_scores in all_candidates.items():
-            scores = [user_scores.get(name, 0.0) for name in user_names]
-
-            avg_score = float(np.mean(scores))
-            min_score = float(min(scores))
-
-            # Least Misery formula
-            fair_score = (1 - fairness_weight) * avg_score + fairness_weight * min_score
-
-            scored_films.append({
-                "movie_id": movie_id,
-                "fair_score": fair_score,
-                "avg_score": avg_score,
-                "min_score": min_score,
-                "individual_scores": user_scores,
-                "feedback_applied": any_feedback_applied
-            })
-
-        # Fair score'a göre sırala
-        scored_films.sort(key=lambda x: x["fair_score"], reverse=True)
-
-        return scored_films[:n_results]
+        scored_films = self._rank_fair(all_candidates, user_names, fairness_weight, n_results)
+        for film in scored_films:
+            film["feedback_applied"] = any_feedback_applied
+        return scored_films
@@ -1,5 +1,11 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel
 load_dotenv()
@@ -7,7 +13,30 @@ load_dotenv()
 from ai.types import ParticipantPreference,GatewayResponse
 from ai.gateway import ModelGateway
 
-app= FastAPI(title='Cinematch Movie Recommendation API')
+#Start model gateway: import'ta değil lifespan'de (main.py ile aynı)
+gateway: Optional[ModelGateway] = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global gateway
+    # main.py ile aynı: to_thread'in default executor'ı CINEMATCH_THREADPOOL_SIZE kadar
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(
+            max_workers=int(os.getenv("CINEMATCH_THREADPOOL_SIZE", "64")),
+            thread_name_prefix="cinematch"
+        )
+    )
+    gateway = ModelGateway()
+    await asyncio.to_thread(gateway.warm_up)
+    yield
+
+
+app= FastAPI(
+    title='Cinematch Movie Recommendation API',
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # CORS - Next.js'in bağlanabilmesi için
 app.add_middleware(
@@ -17,9 +46,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-#Start model gateway
-gateway= ModelGateway()
-
 class RecommendationRequest(BaseModel):
     participants: list[ParticipantPreference]
     num_recommendations: int =5
@@ -27,8 +53,15 @@ class RecommendationRequest(BaseModel):
 @app.post("/recommendations",response_model= GatewayResponse)
 async def get_recommendations(request: RecommendationRequest):
     """Get movie recommendations for the group"""
-    return gateway.recommend(request.participants,request.num_recommendations)
+    # gateway.recommend bloklayıcı (model + Groq); event loop'u tutmasın
+    return await asyncio.to_thread(gateway.recommend, request.participants, request.num_recommendations)
 
 @app.get("/health")
 async def health_check():
     return {"status":"ok"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    # uvicorn[standard]: uvloop event loop + httptools parser
+    uvicorn.run("server:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools")